@@ -5,6 +5,31 @@ This particular module made by myself.
 
 import numpy as np
 
+def extract_detections(result, class_names):
+    """
+    Converts the MaskRCNN result of a single image into the detections
+    returned by mask_rcnn_detect (see there)
+    """
+    # extract bounding box info
+    rects = result['rois']
+    # reshape in format desired by detect_and_range.py
+    rects[:, [1, 0]] = rects[:, [0, 1]]  # swap column 0 and column 1
+    rects[:, [3, 2]] = rects[:, [2, 3]]  # swap column 2 and column 3
+
+    # getting class ids
+    class_ids = result['class_ids']
+
+    # using class ids to index class_names and get detected classes
+    classes = class_names[class_ids]
+
+    # get correspinding scores
+    scores = result['scores']
+
+    # thresholding heuristic
+    mask = np.greater_equal(scores, 0.9)
+
+    return rects[mask], class_ids[mask], classes[mask], scores[mask]
+
 def mask_rcnn_detect(image, model, class_names):
     """
     Detects objects in a given image using MaskRCNN and returns them
@@ -20,28 +45,34 @@ def mask_rcnn_detect(image, model, class_names):
     -classes: class names of each detection
     -scores: confidence scores of each detection
     """
-    # Run detection on the image
-    results = model.detect([image], verbose=0)
-
-    # get results
-    r = results[0]
+    return mask_rcnn_detect_batch([image], model, class_names)[0]
 
-    # extract bounding box info
-    rects = r['rois']
-    # reshape in format desired by detect_and_range.py
-    rects[:, [1, 0]] = rects[:, [0, 1]]  # swap column 0 and column 1
-    rects[:, [3, 2]] = rects[:, [2, 3]]  # swap column 2 and column 3
-
-    # getting class ids
-    class_ids = r['class_ids']
+def mask_rcnn_detect_batch(images, model, class_names):
+    """
+    Detects objects in a list of images using MaskRCNN, running the images
+    through the model in batches of model.config.BATCH_SIZE. A final partial
+    batch is padded with copies of its last image, whose results are dropped
 
-    # using class ids to index class_names and get detected classes
-    classes = class_names[class_ids]
+    Inputs:
+    -images: list of np arrays representing images (all of the same size)
+    -model, class_names: as in mask_rcnn_detect
 
-    # get correspinding scores
-    scores = r['scores']
+    Returns:
+    -detections: list of the (rects, class_ids, classes, scores) of each image,
+    as returned by mask_rcnn_detect
+    """
+    batch_size = model.config.BATCH_SIZE
+    detections = []
+    for start in range(0, len(images), batch_size):
+        batch = list(images[start:start + batch_size])
+        n_images = len(batch)
+        # pad a partial batch (the model is built for a fixed batch size)
+        batch += [batch[-1]] * (batch_size - n_images)
 
-    # thresholding heuristic
-    mask = np.greater_equal(scores, 0.9)
+        # Run detection on the batch of images
+        results = model.detect(batch, verbose=0)
 
-    return rects[mask], class_ids[mask], classes[mask], scores[mask]
+        # get results (of the images that are not padding)
+        for result in results[:n_images]:
+            detections.append(extract_detections(result, class_names))
+    return detections
@@ -721,6 +721,15 @@ def refine_detections_graph(rois, probs, deltas, window, config):
         keep = tf.sets.set_intersection(tf.expand_dims(keep, 0),
                                         tf.expand_dims(conf_keep, 0))
         keep = tf.sparse_tensor_to_dense(keep)[0]
+    # Filter out boxes of classes outside of the allow list
+    if config.DETECTION_CLASS_ALLOW_LIST:
+        allowed_class_ids = tf.constant(config.DETECTION_CLASS_ALLOW_LIST,
+                                        dtype=tf.int32)
+        class_keep = tf.where(tf.reduce_any(tf.equal(
+            class_ids[:, tf.newaxis], allowed_class_ids), axis=1))[:, 0]
+        keep = tf.sets.set_intersection(tf.expand_dims(keep, 0),
+                                        tf.expand_dims(class_keep, 0))
+        keep = tf.sparse_tensor_to_dense(keep)[0]
 
     # Apply per-class NMS
     # 1. Prepare variables
@@ -2044,18 +2053,25 @@ class MaskRCNN():
             detections = DetectionLayer(config, name="mrcnn_detection")(
                 [rpn_rois, mrcnn_class, mrcnn_bbox, input_image_meta])
 
-            # Create masks for detections
-            detection_boxes = KL.Lambda(lambda x: x[..., :4])(detections)
-            mrcnn_mask = build_fpn_mask_graph(detection_boxes, mrcnn_feature_maps,
-                                              input_image_meta,
-                                              config.MASK_POOL_SIZE,
-                                              config.NUM_CLASSES,
-                                              train_bn=config.TRAIN_BN)
-
-            model = KM.Model([input_image, input_image_meta, input_anchors],
-                             [detections, mrcnn_class, mrcnn_bbox,
-                                 mrcnn_mask, rpn_rois, rpn_class, rpn_bbox],
-                             name='mask_rcnn')
+            if config.DETECTION_ONLY:
+                # No mask branch, the model outputs the detections only
+                model = KM.Model([input_image, input_image_meta, input_anchors],
+                                 [detections, mrcnn_class, mrcnn_bbox,
+                                     rpn_rois, rpn_class, rpn_bbox],
+                                 name='mask_rcnn')
+            else:
+                # Create masks for detections
+                detection_boxes = KL.Lambda(lambda x: x[..., :4])(detections)
+                mrcnn_mask = build_fpn_mask_graph(detection_boxes, mrcnn_feature_maps,
+                                                  input_image_meta,
+                                                  config.MASK_POOL_SIZE,
+                                                  config.NUM_CLASSES,
+                                                  train_bn=config.TRAIN_BN)
+
+                model = KM.Model([input_image, input_image_meta, input_anchors],
+                                 [detections, mrcnn_class, mrcnn_bbox,
+                                     mrcnn_mask, rpn_rois, rpn_class, rpn_bbox],
+                                 name='mask_rcnn')
 
         # Add multi-GPU support.
         if config.GPU_COUNT > 1:
@@ -2422,7 +2438,8 @@ class MaskRCNN():
         application.
 
         detections: [N, (y1, x1, y2, x2, class_id, score)] in normalized coordinates
-        mrcnn_mask: [N, height, width, num_classes]
+        mrcnn_mask: [N, height, width, num_classes], or None for detection-only
+            inference (see config.DETECTION_ONLY)
         original_image_shape: [H, W, C] Original image shape before resizing
         image_shape: [H, W, C] Shape of the image after resizing and padding
         window: [y1, x1, y2, x2] Pixel coordinates of box in the image where the real
@@ -2432,7 +2449,8 @@ class MaskRCNN():
         boxes: [N, (y1, x1, y2, x2)] Bounding boxes in pixels
         class_ids: [N] Integer class IDs for each bounding box
         scores: [N] Float probability scores of the class_id
-        masks: [height, width, num_instances] Instance masks
+        masks: [height, width, num_instances] Instance masks, None if
+            mrcnn_mask is None, a utils.LazyMasks if config.LAZY_MASKS
         """
         # How many detections do we have?
         # Detections array is padded with zeros. Find the first class_id == 0.
@@ -2443,7 +2461,8 @@ class MaskRCNN():
         boxes = detections[:N, :4]
         class_ids = detections[:N, 4].astype(np.int32)
         scores = detections[:N, 5]
-        masks = mrcnn_mask[np.arange(N), :, :, class_ids]
+        masks = mrcnn_mask[np.arange(N), :, :, class_ids]\
+            if mrcnn_mask is not None else None
 
         # Translate normalized coordinates in the resized image to pixel
         # coordinates in the original image before resizing
@@ -2466,9 +2485,16 @@ class MaskRCNN():
             boxes = np.delete(boxes, exclude_ix, axis=0)
             class_ids = np.delete(class_ids, exclude_ix, axis=0)
             scores = np.delete(scores, exclude_ix, axis=0)
-            masks = np.delete(masks, exclude_ix, axis=0)
+            if masks is not None:
+                masks = np.delete(masks, exclude_ix, axis=0)
             N = class_ids.shape[0]
 
+        if masks is None:
+            return boxes, class_ids, scores, None
+        if self.config.LAZY_MASKS:
+            return boxes, class_ids, scores,\
+                utils.LazyMasks(masks, boxes, original_image_shape)
+
         # Resize masks to original image size and set boundary threshold.
         full_masks = []
         for i in range(N):
@@ -2480,6 +2506,21 @@ class MaskRCNN():
 
         return boxes, class_ids, scores, full_masks
 
+    def predict_detections(self, molded_images, image_metas, anchors):
+        """Runs the inference model on a batch of molded images.
+
+        Returns:
+        detections: [batch, N, (y1, x1, y2, x2, class_id, score)] in normalized
+            coordinates
+        mrcnn_mask: [batch, N, height, width, num_classes], or None if the
+            model was built without the mask branch (config.DETECTION_ONLY)
+        """
+        outputs = self.keras_model.predict([molded_images, image_metas, anchors],
+                                           verbose=0)
+        if self.config.DETECTION_ONLY:
+            return outputs[0], None
+        return outputs[0], outputs[3]
+
     def detect(self, images, verbose=0):
         """Runs the detection pipeline.
 
@@ -2489,7 +2530,8 @@ class MaskRCNN():
         rois: [N, (y1, x1, y2, x2)] detection bounding boxes
         class_ids: [N] int class IDs
         scores: [N] float probability scores for the class IDs
-        masks: [H, W, N] instance binary masks
+        masks: [H, W, N] instance binary masks, None if config.DETECTION_ONLY,
+            a utils.LazyMasks if config.LAZY_MASKS
         """
         assert self.mode == "inference", "Create model in inference mode."
         assert len(
@@ -2521,13 +2563,14 @@ class MaskRCNN():
             log("image_metas", image_metas)
             log("anchors", anchors)
         # Run object detection
-        detections, _, _, mrcnn_mask, _, _, _ =\
-            self.keras_model.predict([molded_images, image_metas, anchors], verbose=0)
+        detections, mrcnn_mask = self.predict_detections(
+            molded_images, image_metas, anchors)
         # Process detections
         results = []
         for i, image in enumerate(images):
             final_rois, final_class_ids, final_scores, final_masks =\
-                self.unmold_detections(detections[i], mrcnn_mask[i],
+                self.unmold_detections(detections[i],
+                                       mrcnn_mask[i] if mrcnn_mask is not None else None,
                                        image.shape, molded_images[i].shape,
                                        windows[i])
             results.append({
@@ -2550,7 +2593,8 @@ class MaskRCNN():
         rois: [N, (y1, x1, y2, x2)] detection bounding boxes
         class_ids: [N] int class IDs
         scores: [N] float probability scores for the class IDs
-        masks: [H, W, N] instance binary masks
+        masks: [H, W, N] instance binary masks, None if config.DETECTION_ONLY,
+            a utils.LazyMasks if config.LAZY_MASKS
         """
         assert self.mode == "inference", "Create model in inference mode."
         assert len(molded_images) == self.config.BATCH_SIZE,\
@@ -2578,14 +2622,15 @@ class MaskRCNN():
             log("image_metas", image_metas)
             log("anchors", anchors)
         # Run object detection
-        detections, _, _, mrcnn_mask, _, _, _ =\
-            self.keras_model.predict([molded_images, image_metas, anchors], verbose=0)
+        detections, mrcnn_mask = self.predict_detections(
+            molded_images, image_metas, anchors)
         # Process detections
         results = []
         for i, image in enumerate(molded_images):
             window = [0, 0, image.shape[0], image.shape[1]]
             final_rois, final_class_ids, final_scores, final_masks =\
-                self.unmold_detections(detections[i], mrcnn_mask[i],
+                self.unmold_detections(detections[i],
+                                       mrcnn_mask[i] if mrcnn_mask is not None else None,
                                        image.shape, molded_images[i].shape,
                                        window)
             results.append({
@@ -2596,6 +2641,23 @@ class MaskRCNN():
             })
         return results
 
+    def prewarm_anchors(self, image_shape):
+        """Computes and caches the anchors for the images of the given shape
+        once molded (see mold_inputs()), so that the first call to detect()
+        on such images doesn't pay for them.
+        image_shape: [height, width, depth] of the images before molding
+
+        Returns the shape of the molded images.
+        """
+        molded_image = utils.resize_image(
+            np.zeros(image_shape, dtype=np.uint8),
+            min_dim=self.config.IMAGE_MIN_DIM,
+            min_scale=self.config.IMAGE_MIN_SCALE,
+            max_dim=self.config.IMAGE_MAX_DIM,
+            mode=self.config.IMAGE_RESIZE_MODE)[0]
+        self.get_anchors(molded_image.shape)
+        return molded_image.shape
+
     def get_anchors(self, image_shape):
         """Returns anchor pyramid for the given image size."""
         backbone_shapes = compute_backbone_shapes(self.config, image_shape)
@@ -119,6 +119,9 @@ class Config(object):
     #         up before padding. IMAGE_MAX_DIM is ignored in this mode.
     #         The multiple of 64 is needed to ensure smooth scaling of feature
     #         maps up and down the 6 levels of the FPN pyramid (2**6=64).
+    # fit64:  Resizes as in square mode, then pads width and height with zeros
+    #         to make them multiples of 64 only, keeping the aspect ratio of
+    #         the image. IMAGE_MAX_DIM must be a multiple of 64.
     # crop:   Picks random crops from the image. First, scales the image based
     #         on IMAGE_MIN_DIM and IMAGE_MIN_SCALE, then picks a random crop of
     #         size IMAGE_MIN_DIM x IMAGE_MIN_DIM. Can be used in training only.
@@ -157,6 +160,17 @@ class Config(object):
     # To change this you also need to change the neural network mask branch
     MASK_SHAPE = [28, 28]
 
+    # Detection-only inference: build the inference graph without the mask
+    # branch and skip mask unmolding. detect() then returns masks=None. Use it
+    # when only the boxes, class IDs and scores of the detections are needed
+    DETECTION_ONLY = False
+
+    # Return the instance masks of detect() as a utils.LazyMasks container of
+    # the small masks and their boxes, instead of an [H, W, N] array of
+    # full-size masks. Full-size masks, cropped masks and run-length encodings
+    # are then computed per instance, on demand
+    LAZY_MASKS = False
+
     # Maximum number of ground truth instances to use in one image
     MAX_GT_INSTANCES = 100
 
@@ -171,6 +185,11 @@ class Config(object):
     # ROIs below this threshold are skipped
     DETECTION_MIN_CONFIDENCE = 0.7
 
+    # Class IDs to detect. ROIs whose top class is not in the list are
+    # skipped along with the low confidence ones, before per-class NMS.
+    # None keeps all classes
+    DETECTION_CLASS_ALLOW_LIST = None
+
     # Non-maximum suppression threshold for detection
     DETECTION_NMS_THRESHOLD = 0.3
 
@@ -401,6 +401,10 @@ def resize_image(image, min_dim=None, max_dim=None, min_scale=None, mode="square
                before padding. max_dim is ignored in this mode.
                The multiple of 64 is needed to ensure smooth scaling of feature
                maps up and down the 6 levels of the FPN pyramid (2**6=64).
+        fit64: Resizes as in square mode (small side == min_dim, long side
+               <= max_dim), then pads width and height with zeros to make
+               them multiples of 64 only. Keeps the aspect ratio of the
+               image instead of padding it to a square.
         crop: Picks random crops from the image. First, scales the image based
               on min_dim and min_scale, then picks a random crop of
               size min_dim x min_dim. Can be used in training only.
@@ -435,7 +439,7 @@ def resize_image(image, min_dim=None, max_dim=None, min_scale=None, mode="square
         scale = min_scale
 
     # Does it exceed max dim?
-    if max_dim and mode == "square":
+    if max_dim and mode in ["square", "fit64"]:
         image_max = max(h, w)
         if round(image_max * scale) > max_dim:
             scale = max_dim / image_max
@@ -456,10 +460,11 @@ def resize_image(image, min_dim=None, max_dim=None, min_scale=None, mode="square
         padding = [(top_pad, bottom_pad), (left_pad, right_pad), (0, 0)]
         image = np.pad(image, padding, mode='constant', constant_values=0)
         window = (top_pad, left_pad, h + top_pad, w + left_pad)
-    elif mode == "pad64":
+    elif mode in ["pad64", "fit64"]:
         h, w = image.shape[:2]
         # Both sides must be divisible by 64
-        assert min_dim % 64 == 0, "Minimum dimension must be a multiple of 64"
+        if mode == "pad64":
+            assert min_dim % 64 == 0, "Minimum dimension must be a multiple of 64"
         # Height
         if h % 64 > 0:
             max_h = h - (h % 64) + 64
@@ -563,10 +568,8 @@ def unmold_mask(mask, bbox, image_shape):
 
     Returns a binary mask with the same size as the original image.
     """
-    threshold = 0.5
     y1, x1, y2, x2 = bbox
-    mask = resize(mask, (y2 - y1, x2 - x1))
-    mask = np.where(mask >= threshold, 1, 0).astype(np.bool)
+    mask = unmold_cropped_mask(mask, bbox)
 
     # Put the mask in the right location.
     full_mask = np.zeros(image_shape[:2], dtype=np.bool)
@@ -574,6 +577,92 @@ def unmold_mask(mask, bbox, image_shape):
     return full_mask
 
 
+def unmold_cropped_mask(mask, bbox):
+    """Converts a mask generated by the neural network to a binary mask of
+    the size of its box.
+    mask: [height, width] of type float. A small, typically 28x28 mask.
+    bbox: [y1, x1, y2, x2]. The box to fit the mask in.
+
+    Returns a binary mask of shape [y2 - y1, x2 - x1].
+    """
+    threshold = 0.5
+    y1, x1, y2, x2 = bbox
+    mask = resize(mask, (y2 - y1, x2 - x1))
+    return np.where(mask >= threshold, 1, 0).astype(np.bool)
+
+
+class LazyMasks(object):
+    """Instance masks of the detections of one image, kept as the small
+    masks generated by the neural network and their boxes. Full-size masks,
+    cropped masks and run-length encodings are only computed when asked for,
+    so memory use depends on the detections rather than on the image size.
+    See config.LAZY_MASKS.
+    """
+
+    def __init__(self, masks, boxes, image_shape):
+        """
+        masks: [N, height, width] of type float. Small, typically 28x28 masks.
+        boxes: [N, (y1, x1, y2, x2)] in pixels. The boxes to fit the masks in.
+        image_shape: [H, W, ...] Shape of the original image.
+        """
+        self.masks = masks
+        self.boxes = boxes
+        self.image_shape = tuple(image_shape[:2])
+        self._cropped = {}
+
+    def __len__(self):
+        return self.masks.shape[0]
+
+    @property
+    def shape(self):
+        """Shape of the equivalent array of full-size masks, [H, W, N]"""
+        return self.image_shape + (len(self),)
+
+    def cropped(self, i):
+        """Returns the binary mask of instance i, cropped to its box."""
+        if i not in self._cropped:
+            self._cropped[i] = unmold_cropped_mask(self.masks[i], self.boxes[i])
+        return self._cropped[i]
+
+    def full(self, i):
+        """Returns the binary mask of instance i, of the size of the image."""
+        y1, x1, y2, x2 = self.boxes[i]
+        full_mask = np.zeros(self.image_shape, dtype=np.bool)
+        full_mask[y1:y2, x1:x2] = self.cropped(i)
+        return full_mask
+
+    def rle(self, i):
+        """Returns the mask of instance i as an uncompressed run-length
+        encoding, in the COCO format ({"size": [H, W], "counts": [...]},
+        column-major runs starting with a run of zeros). It is computed from
+        the cropped mask, without building the full-size mask.
+        """
+        height, width = self.image_shape
+        y1, x1, _, _ = self.boxes[i]
+        # Indices of the mask pixels in the column-major flattened image, sorted
+        columns, rows = np.nonzero(self.cropped(i).T)
+        pixels = (x1 + columns) * height + y1 + rows
+        if pixels.shape[0] == 0:
+            return {"size": [height, width], "counts": [height * width]}
+        # Split the pixels into runs of consecutive indices
+        breaks = np.where(np.diff(pixels) != 1)[0] + 1
+        starts = pixels[np.concatenate([[0], breaks])]
+        ends = pixels[np.concatenate([breaks - 1, [pixels.shape[0] - 1]])] + 1
+        boundaries = np.stack([starts, ends], axis=1).ravel()
+        counts = np.diff(np.concatenate([[0], boundaries, [height * width]]))
+        # No final run of zeros if the mask reaches the last pixel
+        if counts[-1] == 0:
+            counts = counts[:-1]
+        return {"size": [height, width], "counts": counts.tolist()}
+
+    def to_array(self):
+        """Returns the full-size masks as an array of shape [H, W, N], the
+        format of the masks when config.LAZY_MASKS is off."""
+        if len(self) == 0:
+            return np.empty(self.image_shape + (0,))
+        return np.stack([self.full(i) for i in range(len(self))], axis=-1)
+
+
 ############################################################
 #  Anchors
 ############################################################
@@ -0,0 +1,224 @@
+"""
+functionality: dense HoG feature maps, shared by all the region proposals of a
+frame.
+
+Rather than resizing every proposal to the HoG window size and computing its
+HoG descriptor from scratch, the gradient orientations and the (unnormalized)
+block histograms are computed once per frame, over a small pyramid of scales.
+The descriptor of each proposal is then assembled by resampling the block grid
+of the pyramid level closest to its size, and normalized as the OpenCV
+HOGDescriptor would (see params.HOG_DESC_* for the settings reproduced here).
+"""
+import cv2
+import numpy as np
+import SVM.params as params
+
+# pixels per cell and cells per block (along both axes)
+CELL_SIZE = params.HOG_DESC_cellSize[0]
+BLOCK_CELLS = params.HOG_DESC_blockSize[0] // CELL_SIZE
+# blocks per window (horizontally, vertically)
+WINDOW_BLOCKS = ((params.HOG_DESC_winSize[0] - params.HOG_DESC_blockSize[0]) // params.HOG_DESC_blockStride[0] + 1,
+                 (params.HOG_DESC_winSize[1] - params.HOG_DESC_blockSize[1]) // params.HOG_DESC_blockStride[1] + 1)
+# length of a single (normalized) block histogram
+BLOCK_HISTOGRAM_SIZE = BLOCK_CELLS * BLOCK_CELLS * params.HOG_DESC_nbins
+
+
+def block_weights():
+    """
+    Returns the per-pixel weights of each cell of a block along one axis, as an
+    (cell size, 2 * cells per block) array. Column c * 2 + h holds the weights
+    for cell c of the block, over the pixels of the h-th cell-sized half of the
+    block. The weights are the Gaussian block window (winSigma) times the
+    linear interpolation of each pixel between neighbouring cell centres, as
+    in the OpenCV HOGDescriptor
+    """
+    block_size = BLOCK_CELLS * CELL_SIZE
+    window_sigma = params.HOG_DESC_winSigma
+    if window_sigma < 0:  # OpenCV default
+        window_sigma = (params.HOG_DESC_blockSize[0] + params.HOG_DESC_blockSize[1]) / 8.0
+    pixels = np.arange(block_size)
+    gaussian = np.exp(-(pixels - block_size * 0.5)**2 / (2 * window_sigma**2))
+    weights = np.empty((CELL_SIZE, BLOCK_CELLS * BLOCK_CELLS), dtype=np.float32)
+    for cell in range(BLOCK_CELLS):
+        cell_centre = cell * CELL_SIZE + (CELL_SIZE - 1) / 2.0
+        interpolation = np.maximum(0, 1 - np.abs(pixels - cell_centre) / CELL_SIZE)
+        for half in range(BLOCK_CELLS):
+            weights[:, cell * BLOCK_CELLS + half] = (gaussian * interpolation)[
+                half * CELL_SIZE:(half + 1) * CELL_SIZE]
+    return weights
+
+
+def compute_orientation_planes(image):
+    """
+    Computes the gradient of an image and splits its magnitude between the two
+    nearest (unsigned) orientation bins.
+
+    Input(s):
+    -image: 3 channel (BGR) or grayscale 8-bit image
+
+    Output(s):
+    -planes: (nbins, height, width) float32 array of orientation votes
+    """
+    # gamma correction as square root of the pixel values
+    if params.HOG_DESC_gammaCorrection:
+        gamma_table = np.sqrt(np.arange(256, dtype=np.float32))
+    else:
+        gamma_table = np.arange(256, dtype=np.float32)
+    image = gamma_table[image]
+
+    # centred [-1, 0, 1] derivatives of each channel, reflecting at the borders
+    dx = cv2.Sobel(image, cv2.CV_32F, 1, 0, ksize=1, borderType=cv2.BORDER_REFLECT_101)
+    dy = cv2.Sobel(image, cv2.CV_32F, 0, 1, ksize=1, borderType=cv2.BORDER_REFLECT_101)
+
+    # keep the gradient of the channel with the largest magnitude
+    if image.ndim == 3:
+        channels_dx, channels_dy = cv2.split(dx), cv2.split(dy)
+        dx, dy = channels_dx[0], channels_dy[0]
+        squared_magnitude = dx * dx + dy * dy
+        for channel_dx, channel_dy in zip(channels_dx[1:], channels_dy[1:]):
+            channel_squared_magnitude = channel_dx * channel_dx + channel_dy * channel_dy
+            larger = channel_squared_magnitude > squared_magnitude
+            dx = np.where(larger, channel_dx, dx)
+            dy = np.where(larger, channel_dy, dy)
+            squared_magnitude = np.maximum(squared_magnitude, channel_squared_magnitude)
+    magnitude, angle = cv2.cartToPolar(dx, dy)
+
+    # split the magnitude between the two nearest bins (angles wrap around pi)
+    n_bins = params.HOG_DESC_nbins
+    angle *= n_bins / np.pi
+    angle -= 0.5
+    lower_bin = np.floor(angle)
+    upper_weight = magnitude * (angle - lower_bin)
+    lower_weight = magnitude - upper_weight
+    lower_bin = lower_bin.astype(np.int32) % n_bins
+
+    planes = np.empty((n_bins,) + magnitude.shape, dtype=np.float32)
+    for b in range(n_bins):
+        np.multiply(lower_bin == b, lower_weight, out=planes[b])
+        planes[b] += (lower_bin == (b - 1) % n_bins) * upper_weight
+    return planes
+
+
+def compute_block_histograms(image):
+    """
+    Computes the (unnormalized) histograms of all the blocks of an image, with
+    blocks placed every cell (the block stride).
+
+    Input(s):
+    -image: 3 channel (BGR) or grayscale 8-bit image
+
+    Output(s):
+    -blocks: (n_block_rows, n_block_columns, block histogram size) float32
+    array, with the cells of each block in the order of the OpenCV HOGDescriptor
+    """
+    planes = compute_orientation_planes(image)
+    n_bins, height, width = planes.shape
+    n_cell_rows, n_cell_columns = height // CELL_SIZE, width // CELL_SIZE
+    planes = planes[:, :n_cell_rows * CELL_SIZE, :n_cell_columns * CELL_SIZE]
+    planes = planes.reshape(n_bins, n_cell_rows, CELL_SIZE, n_cell_columns, CELL_SIZE)
+
+    # weighted sums of each cell for every (block cell, block half) weighting,
+    # first along x then along y
+    weights = block_weights()
+    sums = np.tensordot(planes, weights, axes=([4], [0]))
+    sums = np.tensordot(sums, weights, axes=([2], [0]))
+    # sums axes: bin, cell row, cell column, (x cell, x half), (y cell, y half)
+
+    n_block_rows = n_cell_rows - BLOCK_CELLS + 1
+    n_block_columns = n_cell_columns - BLOCK_CELLS + 1
+    blocks = np.zeros((n_block_rows, n_block_columns, BLOCK_CELLS, BLOCK_CELLS, n_bins),
+                      dtype=np.float32)
+    for cell_x in range(BLOCK_CELLS):
+        for cell_y in range(BLOCK_CELLS):
+            for half_x in range(BLOCK_CELLS):
+                for half_y in range(BLOCK_CELLS):
+                    # the half_y, half_x cell of each block, weighted for cell_y, cell_x
+                    half_sums = sums[:, half_y:half_y + n_block_rows, half_x:half_x + n_block_columns,
+                                     cell_x * BLOCK_CELLS + half_x, cell_y * BLOCK_CELLS + half_y]
+                    blocks[:, :, cell_x, cell_y, :] += np.moveaxis(half_sums, 0, -1)
+    return blocks.reshape(n_block_rows, n_block_columns, BLOCK_HISTOGRAM_SIZE)
+
+
+def normalize_blocks(blocks):
+    """
+    L2-Hys normalization of block histograms (along the last axis), as in the
+    OpenCV HOGDescriptor
+    """
+    scale = 1.0 / (np.sqrt(np.sum(blocks**2, axis=-1, keepdims=True)) + 0.1 * BLOCK_HISTOGRAM_SIZE)
+    blocks = np.minimum(blocks * scale, params.HOG_DESC_L2HysThreshold)
+    scale = 1.0 / (np.sqrt(np.sum(blocks**2, axis=-1, keepdims=True)) + 1e-3)
+    return blocks * scale
+
+
+class DenseHOG(object):
+    """
+    Dense HoG feature map of an image over a pyramid of scales, from which the
+    HoG descriptors of any number of rects are assembled
+    """
+
+    def __init__(self, image, scales=params.HOG_DENSE_SCALES):
+        self.scales = np.array(scales, dtype=np.float64)
+        self.level_blocks = []
+        for scale in self.scales:
+            if scale == 1:
+                level_image = image
+            else:
+                interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+                level_image = cv2.resize(image, None, fx=scale, fy=scale,
+                                         interpolation=interpolation)
+            self.level_blocks.append(compute_block_histograms(level_image))
+
+    def compute_descriptors(self, rectangles):
+        """
+        Assembles the HoG descriptors of a set of rects, as if each rect was
+        resized to the HoG window size and described on its own.
+
+        Input(s):
+        -rectangles: (N, 4) array-like of rects, where rect = x1, y1, x2, y2
+
+        Output(s):
+        -descriptors: (N, descriptor size) float32 array
+        """
+        rectangles = np.asarray(rectangles, dtype=np.float64).reshape(-1, 4)
+        descriptors = np.empty((len(rectangles), WINDOW_BLOCKS[1], WINDOW_BLOCKS[0],
+                                BLOCK_HISTOGRAM_SIZE), dtype=np.float32)
+        if len(rectangles) == 0:
+            return descriptors.reshape(0, -1)
+        x1, y1 = rectangles[:, 0], rectangles[:, 1]
+        # size of the rects relative to the window
+        x_scale = (rectangles[:, 2] - x1) / params.HOG_DESC_winSize[0]
+        y_scale = (rectangles[:, 3] - y1) / params.HOG_DESC_winSize[1]
+
+        # use the level at which the rects are closest to the window size
+        levels = np.argmin(np.abs(np.log(np.sqrt(x_scale * y_scale)[:, np.newaxis] *
+                                         self.scales[np.newaxis, :])), axis=1)
+
+        # top left corner of each window block, in window pixels
+        block_x = np.arange(WINDOW_BLOCKS[0]) * params.HOG_DESC_blockStride[0]
+        block_y = np.arange(WINDOW_BLOCKS[1]) * params.HOG_DESC_blockStride[1]
+
+        for level, (scale, blocks) in enumerate(zip(self.scales, self.level_blocks)):
+            in_level = np.flatnonzero(levels == level)
+            if len(in_level) == 0:
+                continue
+            # position of each window block on the block grid of the level
+            grid_x = (x1[in_level, np.newaxis] + block_x * x_scale[in_level, np.newaxis]) * scale / CELL_SIZE
+            grid_y = (y1[in_level, np.newaxis] + block_y * y_scale[in_level, np.newaxis]) * scale / CELL_SIZE
+            grid_x = np.clip(grid_x, 0, blocks.shape[1] - 1)
+            grid_y = np.clip(grid_y, 0, blocks.shape[0] - 1)
+
+            # bilinear resampling of the block grid
+            x0 = np.minimum(np.floor(grid_x).astype(np.intp), blocks.shape[1] - 2).clip(0)
+            y0 = np.minimum(np.floor(grid_y).astype(np.intp), blocks.shape[0] - 2).clip(0)
+            x1_ = np.minimum(x0 + 1, blocks.shape[1] - 1)
+            y1_ = np.minimum(y0 + 1, blocks.shape[0] - 1)
+            wx = (grid_x - x0)[:, np.newaxis, :, np.newaxis]
+            wy = (grid_y - y0)[:, :, np.newaxis, np.newaxis]
+            y0, y1_ = y0[:, :, np.newaxis], y1_[:, :, np.newaxis]
+            x0, x1_ = x0[:, np.newaxis, :], x1_[:, np.newaxis, :]
+            descriptors[in_level] = ((1 - wy) * ((1 - wx) * blocks[y0, x0] + wx * blocks[y0, x1_]) +
+                                     wy * ((1 - wx) * blocks[y1_, x0] + wx * blocks[y1_, x1_]))
+
+        # blocks of the descriptor are ordered by column (as in OpenCV)
+        descriptors = normalize_blocks(descriptors).transpose(0, 2, 1, 3)
+        return descriptors.reshape(len(rectangles), -1)
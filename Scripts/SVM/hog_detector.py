@@ -5,56 +5,100 @@ using selective search region proposal
 import utils
 import SVM.params as params
 import SVM.selective_search as selective_search
+import SVM.dense_hog as dense_hog
+import SVM.stixel_proposals as stixel_proposals
 import numpy as np
 
+HUMAN_HEIGHT = 1.75  # meters, on average
+HUMAN_WIDTH = 1.75 / 2  # meters, approximating
+# rows at the top of the image (sky) ignored by selective search (heuristic)
+SKY_ROWS = 116
 
-def hog_detect(image, svm_object, ss_object, disparity_image, focal_length, distance_between_cameras):
+
+def compute_region_depths(region_rects, disparity_image, focal_length, distance_between_cameras):
     """
-    Performs detection on an image via an SVM classifier trained on HoG
-    descriptors. Returns detected object rectangles, their class codes, and their
-    depths in the image
+    Estimates the depth of each region proposal, either from a per-frame
+    integral disparity histogram or proposal by proposal (see params)
 
     Input(s):
-    -image: numpy array representing an image
-    -svm_object: cv2.ml.SVM_load(<trained_xml_file>) SVM object
-    -disparity_image: numpy array corresponding to the disparity of "image"
-    -focal_length: the focal length in pixels of the cameras used
-    -distance_between_cameras: the baseline distance in meters between the cameras
+    -region_rects: (N, 4) array of rects, where rect = x1, y1, x2, y2
+    -disparity_image, focal_length, distance_between_cameras: as in hog_detect
 
     Output(s):
-    -detections: list of rects, where rect = x1, y1, x2, y2
-    -detection_classes: list of class codes corresponding to rects
-    -detection_depths: list of depths (meters) of each detected rect
+    -region_depths: (N,) array of depths (meters)
     """
-    human_height = 1.75  # meters, on average
-    human_width = 1.75 / 2  # meters, approximating
+    if params.HOG_DETECT_INTEGRAL_HISTOGRAM:
+        disparity_histogram = utils.IntegralDisparityHistogram(
+            disparity_image, focal_length, distance_between_cameras,
+            params.HOG_DETECT_HISTOGRAM_BIN_WIDTH)
+        return disparity_histogram.compute_depths(region_rects)
+    return np.fromiter((utils.compute_single_depth(
+        rect, disparity_image, focal_length, distance_between_cameras) for rect in region_rects), float)
 
-    # initialize detections and corresponding detection_classes lists
-    detections = []
-    detection_classes = []
-    detection_depths = []
 
-    # get rid of sky when performing selective search (heuristic)
-    roi = utils.select_roi_maintain_size(image, 116)
+def filter_region_proposals(region_proposals, min_area, disparity_image, focal_length, distance_between_cameras):
+    """
+    Applies the region proposal heuristics to all the proposals at once, so that
+    only the surviving proposals are cropped and described. Proposals must be
+    taller than wide, larger than min_area and of a sensible size for a person
+    at their depth (see utils.area_depth_heuristic). Depths are only computed
+    for the proposals passing the first two checks
 
-    # perform selective_search, returns list of region proposals
-    region_proposals = selective_search.perform_selective_search(
-        roi, ss_object, 1000, 3600)
+    Input(s):
+    -region_proposals: (N, 4) array of rects, where rect = x1, y1, w, h
+    -min_area: the min_area a proposed region can be
+    -disparity_image, focal_length, distance_between_cameras: as in hog_detect
 
-    # loop through region proposals
-    for region_proposal_rect in region_proposals:
-        # extract information from the region proposal
-        x1, y1, w, h = region_proposal_rect
-        x2, y2 = (x1 + w), (y1 + h)
+    Output(s):
+    -region_rects: (M, 4) array of the surviving rects, where rect = x1, y1, x2, y2
+    -region_depths: (M,) array of their depths (meters)
+    """
+    # the depths are timed as a stage of their own, the filtering around them
+    # as "proposal filter"
+    with utils.stage_timer.time("proposal filter"):
+        widths, heights = region_proposals[:, 2], region_proposals[:, 3]
+        # get mask for accepted rects (can be considered a heuristic)
+        mask = np.logical_and(
+            # return only regions where h > width
+            np.greater(heights, widths),
+            # return only sufficiently large regions
+            np.greater(widths * heights, min_area)
+        )
+        region_proposals = region_proposals[mask]
+        region_rects = np.column_stack((region_proposals[:, :2],
+                                        region_proposals[:, :2] + region_proposals[:, 2:]))
+
+    # calculate distance to each remaining region
+    with utils.stage_timer.time("proposal depth"):
+        region_depths = compute_region_depths(
+            region_rects, disparity_image, focal_length, distance_between_cameras)
+
+    # check the detected area sizes make sense (heuristic)
+    with utils.stage_timer.time("proposal filter"):
+        mask = utils.area_depth_heuristic(HUMAN_HEIGHT, HUMAN_WIDTH, region_proposals[:, 3],
+                                          region_proposals[:, 2], region_depths, focal_length, 0.4)
+        return region_rects[mask], region_depths[mask]
+
+
+def compute_hog_descriptors(image, region_rects):
+    """
+    Computes the HoG descriptors of the given regions of an image, either from a
+    dense HoG feature map of the whole image or region by region (see params)
 
-        # calculate distance to observed region
-        region_depth = utils.compute_single_depth(
-            (x1, y1, x2, y2), disparity_image, focal_length, distance_between_cameras)
+    Input(s):
+    -image: numpy array representing an image
+    -region_rects: list of rects, where rect = x1, y1, x2, y2
 
-        # check the detected area size makes sense (heuristic)
-        if not (utils.area_depth_heuristic(human_height, human_width, h, w, region_depth, focal_length, 0.4)):
-            continue
+    Output(s):
+    -descriptors: list of HoG descriptors (1D arrays), one per rect
+    """
+    if len(region_rects) == 0:
+        return []
+    if params.HOG_DETECT_DENSE_FEATURES:
+        return list(dense_hog.DenseHOG(image).compute_descriptors(region_rects))
 
+    descriptors = []
+    for x1, y1, x2, y2 in region_rects:
         # get the corresponding window
         region_proposal = utils.crop_image(image, y1, y2, x1, x2)
 
@@ -63,37 +107,111 @@ def hog_detect(image, svm_object, ss_object, disparity_image, focal_length, dist
 
         # compute the hog descriptor
         img_data.compute_hog_descriptor()
+        descriptors.append(img_data.hog_descriptor.ravel())
+    return descriptors
+
 
-        # classify each HoG by passing it through the SVM classifier
-        if img_data.hog_descriptor is not None:
-            # apply svm classification
-            retval, [result] = svm_object.predict(
-                np.float32([img_data.hog_descriptor]))
-            class_number = result[0]
-
-            # if we get a detection, then record it
-            if class_number == params.DATA_CLASS_NAMES["person"]:
-                rect = x1, y1, x2, y2
-                # append the rect to the list of detections
-                detections.append(rect)
-                # append class number to list of class numbers
-                detection_classes.append(class_number)
-                # append detection depth to the list of detection depths
-                detection_depths.append(region_depth)
-
-    # converting to numpy.arrays for convenience
-    detections = np.array(detections)
-    detection_classes = np.array(detection_classes)
-    detection_depths = np.array(detection_depths)
+def propose_regions(image, ss_object, disparity_image, focal_length, distance_between_cameras,
+                    proposal_tracker=None):
+    """
+    Proposes the regions of an image to classify, with the proposal engine set
+    in params (see hog_detect for the inputs)
+
+    Output(s):
+    -region_proposals: (N, 4) array of rects, where rect = x1, y1, w, h
+    """
+    # get rid of sky when performing selective search (heuristic)
+    roi = utils.select_roi_maintain_size(image, SKY_ROWS)
+
+    # selective search profile the ss_object was created for
+    ss_profile = params.SS_PROFILES[params.SS_PROFILE]
+
+    # perform selective_search (or carry the proposals of the previous frames
+    # forward), or propose regions from the disparity. Returns list of region
+    # proposals
+    if params.PROPOSAL_ENGINE == "stixel":
+        with utils.stage_timer.time("stixel proposals"):
+            return stixel_proposals.generate_stixel_proposals(
+                disparity_image, focal_length, distance_between_cameras,
+                HUMAN_HEIGHT, HUMAN_WIDTH, params.STIXEL_MAX_RECTS)
+    if proposal_tracker is not None:
+        return proposal_tracker.propose(roi, ss_object, ss_profile)
+    with utils.stage_timer.time("selective search"):
+        return selective_search.perform_selective_search(roi, ss_object, ss_profile)
+
+
+def hog_detect(image, svm_object, ss_object, disparity_image, focal_length, distance_between_cameras,
+               proposal_tracker=None, region_proposals=None):
+    """
+    Performs detection on an image via an SVM classifier trained on HoG
+    descriptors. Returns detected object rectangles, their class codes, and their
+    depths in the image
+
+    Input(s):
+    -image: numpy array representing an image
+    -svm_object: cv2.ml.SVM_load(<trained_xml_file>) SVM object
+    -ss_object: selective search object, created for params.SS_PROFILE by
+    selective_search.create_selective_search
+    -disparity_image: numpy array corresponding to the disparity of "image"
+    -focal_length: the focal length in pixels of the cameras used
+    -distance_between_cameras: the baseline distance in meters between the cameras
+    -proposal_tracker: optional proposal_tracking.ProposalTracker, reusing the
+    proposals of the previous frames instead of running selective search on
+    every frame
+    -region_proposals: optional precomputed (N, 4) array of region proposals
+    (x1, y1, w, h), e.g. read from a cache. Computed with propose_regions
+    otherwise
+
+    Output(s):
+    -detections: list of rects, where rect = x1, y1, x2, y2
+    -detection_classes: list of class codes corresponding to rects
+    -detection_depths: list of depths (meters) of each detected rect
+    """
+    # get the region proposals
+    if region_proposals is None:
+        region_proposals = propose_regions(
+            image, ss_object, disparity_image, focal_length, distance_between_cameras,
+            proposal_tracker)
+
+    # keep only the proposals passing the heuristics (and their depths)
+    candidate_rects, candidate_depths = filter_region_proposals(
+        region_proposals, params.SS_PROFILES[params.SS_PROFILE]["min_area"], disparity_image, focal_length, distance_between_cameras)
+
+    # compute the HoG descriptor of each remaining proposal
+    with utils.stage_timer.time("HOG"):
+        candidate_descriptors = compute_hog_descriptors(image, candidate_rects)
+
+    detections = candidate_rects
+    detection_depths = candidate_depths
+    detection_classes = np.array([], dtype=np.float32)
+
+    # classify all the HoGs at once by passing them through the SVM classifier
+    if len(candidate_descriptors) > 0:
+        # apply svm classification, as a single batch
+        with utils.stage_timer.time("SVM predict"):
+            retval, results = svm_object.predict(
+                np.float32(candidate_descriptors))
+        detection_classes = results.ravel()
+
+        # if we get a detection, then record it
+        is_detection = detection_classes == params.DATA_CLASS_NAMES["person"]
+        detections = detections[is_detection]
+        detection_classes = detection_classes[is_detection]
+        detection_depths = detection_depths[is_detection]
 
     # remove overlapping boxes.
     # get indices of surviving boxes
-    surviving_indeces = utils.non_max_suppression_fast(
-        np.int32(detections), 0.4)
+    with utils.stage_timer.time("NMS"):
+        surviving_indeces = utils.non_max_suppression_fast(
+            np.int32(detections), 0.4)
     # keep only surviving detections
     detections = detections[surviving_indeces].astype("int")
     detection_classes = detection_classes[surviving_indeces]
     detection_depths = detection_depths[surviving_indeces]
 
+    # carry the detections forward to the next frames
+    if proposal_tracker is not None:
+        proposal_tracker.confirm(detections)
+
     # return detection rects and respective detection_classes and depths
     return detections, detection_classes, detection_depths
@@ -70,4 +70,86 @@ HOG_SVM_max_training_iterations = 500  # stop training after max iterations
 HOG_SVM_DEGREE = 3 #if poly kernel used
     #</section>
 
+    #<section>~~~~~~~~~~~~~~~~~~HoG Detection Settings~~~~~~~~~~~~~~~~~~~~~~~~~~
+# estimate the depth of the region proposals from an integral disparity histogram
+# built once per frame (constant time per proposal), rather than by counting the
+# disparities of each proposal. Pays off with many and/or large proposals
+HOG_DETECT_INTEGRAL_HISTOGRAM = False
+# disparity values per bin of the integral histogram. 1 gives the same depths as
+# utils.compute_single_depth, coarser bins build faster but approximate
+HOG_DETECT_HISTOGRAM_BIN_WIDTH = 1
+# assemble the HoG descriptors of the proposals from a dense HoG feature map
+# computed once per frame (see dense_hog.py), rather than one by one. The
+# descriptors differ from those of resized windows the saved SVMs were trained
+# on (correlation about 0.4-0.8 on arbitrary proposals), so the SVM may need
+# retraining before turning this on
+HOG_DETECT_DENSE_FEATURES = False
+# scales of the dense HoG feature map pyramid. Each proposal is described at
+# the scale where its size is closest to the window size
+HOG_DENSE_SCALES = (1.0, 0.7071, 0.5, 0.3536)
+    #</section>
+
+    #<section>~~~~~~~~~~~~~~~~Selective Search Settings~~~~~~~~~~~~~~~~~~~~~~~~~
+# selective search profile used for the region proposals (key of SS_PROFILES)
+SS_PROFILE = "quality"
+# selective search speed profiles:
+# -scale: factor the frame is resized by before segmentation. The proposals are
+#  mapped back to full resolution
+# -color_spaces: colour spaces of the segmented images. None runs OpenCV's own
+#  fast mode, configured again on every frame
+# -graph_ks, graph_sigma: k and sigma of each graph segmentation
+# -strategies: the similarity measures combined by each strategy
+# -max_rects: maximum number of proposals kept (before filtering)
+# -min_area: minimum area (full resolution pixels) of a kept proposal
+SS_PROFILES = {
+    "quality": {"scale": 1.0, "color_spaces": None,
+                "max_rects": 1000, "min_area": 3600},
+    "fast": {"scale": 0.5, "color_spaces": ("HSV", "Lab"),
+             "graph_ks": (150, 300), "graph_sigma": 0.8,
+             "strategies": (("color", "fill", "size", "texture"), ("fill", "size")),
+             "max_rects": 800, "min_area": 3600},
+    "fastest": {"scale": 0.5, "color_spaces": ("HSV",),
+                "graph_ks": (200,), "graph_sigma": 0.8,
+                "strategies": (("color", "fill", "size", "texture"),),
+                "max_rects": 400, "min_area": 2500},
+}
+# run full selective search only every few frames, carrying the proposals and
+# detections forward with sparse optical flow in between (see
+# proposal_tracking.py). Frames are expected in order (consecutive)
+HOG_DETECT_PROPOSAL_REUSE = False
+# frames between full selective search runs (at most)
+PROPOSAL_REUSE_INTERVAL = 5
+# mean absolute grey level difference to the previous (downscaled) frame above
+# which selective search runs again
+PROPOSAL_REUSE_SCENE_CHANGE = 12.0
+# jittered boxes added around each carried detection, and their maximum offset
+# and rescaling (as a fraction of the detection size)
+PROPOSAL_REUSE_JITTER_BOXES = 8
+PROPOSAL_REUSE_JITTER = 0.1
+    #</section>
+
+    #<section>~~~~~~~~~~~~~~~~~~Region Proposal Settings~~~~~~~~~~~~~~~~~~~~~~~~
+# region proposal engine: "selective_search" (see the settings above) or
+# "stixel", person-sized boxes standing on the obstacles of the disparity image
+# (see stixel_proposals.py). The latter needs no colour segmentation at all
+PROPOSAL_ENGINE = "selective_search"
+# maximum number of stixel proposals kept (before filtering)
+STIXEL_MAX_RECTS = 200
+# width (pixels) of the stripes of columns the obstacles are split into
+STIXEL_STRIPE_WIDTH = 8
+# disparity values per stixel disparity bin
+STIXEL_DISPARITY_BIN_WIDTH = 2
+# minimum fraction of the expected size of a person at the stixel disparity that
+# the obstacle pixels of a stixel must fill
+STIXEL_MIN_FILL = 0.25
+# ground plane fit on the v-disparity image: pixels of a row needed at its most
+# common disparity, rows needed for a fit, and maximum distance (disparity) of
+# ground pixels from the fitted line
+STIXEL_GROUND_MIN_COUNT = 20
+STIXEL_GROUND_MIN_ROWS = 20
+STIXEL_GROUND_TOLERANCE = 2
+# overlap above which the boxes of neighbouring stixels are merged
+STIXEL_NMS_OVERLAP = 0.6
+    #</section>
+
 #</section>
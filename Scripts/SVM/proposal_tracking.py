@@ -0,0 +1,173 @@
+"""
+functionality: reuse of the region proposals between consecutive frames.
+
+Full selective search only runs every few frames, or when the scene changes too
+much. In between, the proposals of the last full run and the detections of the
+previous frame are carried forward with the motion estimated by sparse optical
+flow, and a few jittered boxes are added around each carried detection.
+"""
+import cv2
+import numpy as np
+import utils
+import SVM.params as params
+import SVM.selective_search as selective_search
+
+# downscaling of the frames the scene change metric compares
+SCENE_CHANGE_SCALE = 0.125
+# grid (rows, columns) over which the optical flow is averaged
+FLOW_GRID = (4, 8)
+# fewer successfully tracked points than this forces a full selective search
+MIN_TRACKED_POINTS = 20
+
+
+class ProposalTracker(object):
+    """
+    Keeps the region proposals and detections of the previous frames, and
+    decides on every frame whether to run full selective search or to carry
+    them forward (see params.HOG_DETECT_PROPOSAL_REUSE)
+    """
+
+    def __init__(self, refresh_interval=params.PROPOSAL_REUSE_INTERVAL,
+                 scene_change_threshold=params.PROPOSAL_REUSE_SCENE_CHANGE,
+                 jitter_boxes=params.PROPOSAL_REUSE_JITTER_BOXES,
+                 jitter=params.PROPOSAL_REUSE_JITTER):
+        self.refresh_interval = refresh_interval
+        self.scene_change_threshold = scene_change_threshold
+        self.jitter_boxes = jitter_boxes
+        self.jitter = jitter
+        self.random = np.random.RandomState(0)
+        self.previous_gray = None
+        self.previous_thumbnail = None
+        self.proposals = np.empty((0, 4))  # x1, y1, w, h
+        self.detections = np.empty((0, 4))  # x1, y1, x2, y2
+        self.frames_since_refresh = 0
+
+    def scene_change(self, thumbnail):
+        """
+        Mean absolute difference (grey levels) between the downscaled frame and
+        the previous one
+        """
+        if self.previous_thumbnail is None or thumbnail.shape != self.previous_thumbnail.shape:
+            return np.inf
+        return cv2.absdiff(thumbnail, self.previous_thumbnail).mean()
+
+    def estimate_flow(self, gray):
+        """
+        Estimates the motion since the previous frame with sparse (Lucas-Kanade)
+        optical flow, averaged over the cells of a coarse grid.
+
+        Input(s):
+        -gray: grayscale frame
+
+        Output(s):
+        -cell_flow: (grid rows, grid columns, 2) array of x, y displacements,
+        or None if too few points could be tracked
+        """
+        points = cv2.goodFeaturesToTrack(self.previous_gray, 400, 0.01, 8)
+        if points is None or len(points) < MIN_TRACKED_POINTS:
+            return None
+        moved_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.previous_gray, gray, points, None, winSize=(21, 21), maxLevel=3)
+        tracked = status.ravel() == 1
+        if np.count_nonzero(tracked) < MIN_TRACKED_POINTS:
+            return None
+        points = points.reshape(-1, 2)[tracked]
+        flow = moved_points.reshape(-1, 2)[tracked] - points
+
+        # mean flow of the points of each grid cell, cells without points take
+        # the median flow of the frame
+        height, width = gray.shape
+        rows, columns = FLOW_GRID
+        cells = (np.minimum(points[:, 1] * rows // height, rows - 1).astype(np.intp) * columns +
+                 np.minimum(points[:, 0] * columns // width, columns - 1).astype(np.intp))
+        counts = np.bincount(cells, minlength=rows * columns)
+        cell_flow = np.tile(np.median(flow, axis=0), (rows * columns, 1))
+        has_points = counts > 0
+        for axis in range(2):
+            sums = np.bincount(cells, weights=flow[:, axis], minlength=rows * columns)
+            cell_flow[has_points, axis] = sums[has_points] / counts[has_points]
+        return cell_flow.reshape(rows, columns, 2)
+
+    def shift_rects(self, rects, cell_flow, shape):
+        """
+        Shifts (x1, y1, w, h) rects by the flow of the grid cell of their centre
+        """
+        if len(rects) == 0:
+            return rects
+        height, width = shape
+        rows, columns = FLOW_GRID
+        centres = rects[:, :2] + rects[:, 2:] / 2.0
+        cell_rows = np.clip(centres[:, 1] * rows // height, 0, rows - 1).astype(np.intp)
+        cell_columns = np.clip(centres[:, 0] * columns // width, 0, columns - 1).astype(np.intp)
+        shifted = rects.copy()
+        shifted[:, :2] += cell_flow[cell_rows, cell_columns]
+        return shifted
+
+    def jittered_boxes(self, rects):
+        """
+        Returns jitter_boxes randomly shifted and rescaled copies of each
+        (x1, y1, w, h) rect
+        """
+        if len(rects) == 0 or self.jitter_boxes == 0:
+            return np.empty((0, 4))
+        rects = np.repeat(rects, self.jitter_boxes, axis=0)
+        offsets = self.random.uniform(-self.jitter, self.jitter, (len(rects), 2))
+        scales = 1 + self.random.uniform(-self.jitter, self.jitter, (len(rects), 1))
+        sizes = rects[:, 2:] * scales
+        centres = rects[:, :2] + rects[:, 2:] * (0.5 + offsets)
+        return np.column_stack((centres - sizes / 2.0, sizes))
+
+    def propose(self, image, ss_object, ss_profile):
+        """
+        Returns the region proposals of a frame: from full selective search, or
+        carried forward from the previous frames
+
+        Input(s):
+        -image: numpy array representing an image
+        -ss_object, ss_profile: as in selective_search.perform_selective_search
+
+        Output(s):
+        -rects: (N, 4) array of region proposals (rects), where rect = x1, y1, w, h
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, None, fx=SCENE_CHANGE_SCALE, fy=SCENE_CHANGE_SCALE,
+                               interpolation=cv2.INTER_AREA)
+
+        cell_flow = None
+        if (self.frames_since_refresh + 1 < self.refresh_interval and
+                self.scene_change(thumbnail) <= self.scene_change_threshold):
+            with utils.stage_timer.time("proposal tracking"):
+                cell_flow = self.estimate_flow(gray)
+
+        if cell_flow is None:
+            with utils.stage_timer.time("selective search"):
+                rects = selective_search.perform_selective_search(image, ss_object, ss_profile)
+            self.proposals = rects.astype(np.float64)
+            self.frames_since_refresh = 0
+        else:
+            with utils.stage_timer.time("proposal tracking"):
+                self.proposals = self.shift_rects(self.proposals, cell_flow, gray.shape)
+                detections = np.column_stack((self.detections[:, :2],
+                                              self.detections[:, 2:] - self.detections[:, :2]))
+                detections = self.shift_rects(detections, cell_flow, gray.shape)
+                rects = np.concatenate((self.proposals, detections, self.jittered_boxes(detections)))
+
+                # keep the rects inside the frame
+                height, width = gray.shape
+                rects = np.round(rects).astype(np.int32)
+                rects[:, :2] = np.maximum(rects[:, :2], 0)
+                rects[:, 2] = np.minimum(rects[:, 2], width - rects[:, 0])
+                rects[:, 3] = np.minimum(rects[:, 3], height - rects[:, 1])
+                rects = rects[np.logical_and(rects[:, 2] > 0, rects[:, 3] > 0)]
+            self.frames_since_refresh += 1
+
+        self.previous_gray = gray
+        self.previous_thumbnail = thumbnail
+        return rects
+
+    def confirm(self, detections):
+        """
+        Records the detections of the current frame (rects x1, y1, x2, y2), to be
+        carried forward to the next frames
+        """
+        self.detections = np.asarray(detections, dtype=np.float64).reshape(-1, 4)
@@ -4,43 +4,104 @@ performs selective search bounding box identification
 import cv2
 import numpy as np
 
+# colour conversions of the colour spaces a selective search profile can segment
+COLOR_SPACE_CONVERSIONS = {
+    "HSV": cv2.COLOR_BGR2HSV,
+    "Lab": cv2.COLOR_BGR2Lab,
+    "RGB": cv2.COLOR_BGR2RGB,
+}
 
-def perform_selective_search(image, ss_object, max_rects, min_area):
+# constructors of the similarity measures a selective search strategy can combine
+STRATEGY_CONSTRUCTORS = {
+    "color": cv2.ximgproc.segmentation.createSelectiveSearchSegmentationStrategyColor,
+    "fill": cv2.ximgproc.segmentation.createSelectiveSearchSegmentationStrategyFill,
+    "size": cv2.ximgproc.segmentation.createSelectiveSearchSegmentationStrategySize,
+    "texture": cv2.ximgproc.segmentation.createSelectiveSearchSegmentationStrategyTexture,
+}
+
+
+def create_selective_search(profile):
+    """
+    Creates a selective search object for a profile (see params.SS_PROFILES).
+    Its graph segmentations are configured here, once, rather than on every
+    frame
+
+    Input(s):
+    -profile: dict of selective search profile settings
+
+    Output(s):
+    -ss_object: OpenCV selective search object instance
+    """
+    ss_object = cv2.ximgproc.segmentation.createSelectiveSearchSegmentation()
+    # OpenCV's fast mode is configured from the base image, on every frame
+    if profile["color_spaces"] is None:
+        return ss_object
+
+    for k in profile["graph_ks"]:
+        ss_object.addGraphSegmentation(
+            cv2.ximgproc.segmentation.createGraphSegmentation(profile["graph_sigma"], k))
+    return ss_object
+
+
+def set_strategies(ss_object, profile):
+    """
+    Replaces the strategies of a selective search object by fresh ones, as set
+    out by a profile (see params.SS_PROFILES). The strategies keep the regions
+    of the last image they were given, and reusing them on a new frame can
+    corrupt memory, so new ones are needed for every frame (they are cheap)
+    """
+    ss_object.clearStrategies()
+    for measures in profile["strategies"]:
+        ss_object.addStrategy(
+            cv2.ximgproc.segmentation.createSelectiveSearchSegmentationStrategyMultiple(
+                *[STRATEGY_CONSTRUCTORS[measure]() for measure in measures]))
+
+
+def perform_selective_search(image, ss_object, profile):
     """
     Performs Selective Search on a given image, returning a list of proposed
-    regions.
+    regions. The proposals are not filtered here, see
+    hog_detector.filter_region_proposals
 
     Input(s):
     -image: numpy array representing an image
-    -ss_object: OpenCV selective search object instance
-    -max_rects: the maximum number of rectangles to return
-    -min_area: the min_area a proposed region can be
+    -ss_object: selective search object created by create_selective_search
+    -profile: dict of selective search profile settings, the one ss_object was
+    created for
 
     Output(s):
-    -accepted_rects: list of region proposals (rects)
+    -rects: (N, 4) array of region proposals (rects), where rect = x1, y1, w, h
     """
-    # Set the base image of the object
-    ss_object.setBaseImage(image)
+    scale = profile["scale"]
+    segmented_image = image
+    if scale != 1:
+        segmented_image = cv2.resize(image, None, fx=scale, fy=scale,
+                                     interpolation=cv2.INTER_AREA)
+
+    if profile["color_spaces"] is None:
+        # Set the base image of the object
+        ss_object.setBaseImage(segmented_image)
 
-    # Switch to fast but low recall Selective Search method
-    ss_object.switchToSelectiveSearchFast()
+        # Switch to fast but low recall Selective Search method
+        ss_object.switchToSelectiveSearchFast()
+    else:
+        # replace the images and strategies of the previous frame
+        set_strategies(ss_object, profile)
+        ss_object.clearImages()
+        for color_space in profile["color_spaces"]:
+            ss_object.addImage(cv2.cvtColor(
+                segmented_image, COLOR_SPACE_CONVERSIONS[color_space]))
 
-    # run selective search segmentation on image set as Base
+    # run selective search segmentation on the images set
     rects = ss_object.process()  # one rect: x1, y1, w, h
 
     # keep only the first max_rects number of regions
-    rects = np.array(rects)[:max_rects]
-
-    # get mask for accepted rects (can be considered a heuristic)
-    mask = np.logical_and(
-        # return only regions where h > width
-        np.greater(rects[:, 3], rects[:, 2]),
-        # return only sufficiently large regions
-        np.greater(rects[:, 2] * rects[:, 3], min_area)
-    )
-
-    # filtering out results
-    accepted_rects = rects[mask]
+    rects = np.array(rects).reshape(-1, 4)[:profile["max_rects"]]
 
-    # and returning
-    return accepted_rects
+    # map the rects back to the full resolution image, keeping them inside it
+    if scale != 1:
+        rects = np.round(rects / scale).astype(rects.dtype)
+        height, width = image.shape[:2]
+        rects[:, 2] = np.minimum(rects[:, 2], width - rects[:, 0])
+        rects[:, 3] = np.minimum(rects[:, 3], height - rects[:, 1])
+    return rects
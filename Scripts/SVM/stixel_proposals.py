@@ -0,0 +1,118 @@
+"""
+functionality: region proposals from the disparity image, as an alternative to
+selective search.
+
+The ground plane is estimated from the v-disparity image (the histogram of the
+disparities of each image row), and the pixels standing out of it are split
+into upright obstacle columns ("stixels") of roughly constant disparity, one
+per stripe of image columns and disparity bin. Each stixel gives a single
+person-sized box, standing on its lowest pixel, whose size follows from its
+disparity, the focal length and the size of a person.
+"""
+import numpy as np
+import utils
+import SVM.params as params
+
+
+def fit_ground_disparity(disparity_image):
+    """
+    Fits the ground plane on the v-disparity image: on a flat road, the ground
+    disparity grows linearly with the image row
+
+    Input(s):
+    -disparity_image: 8-bit disparity image
+
+    Output(s):
+    -ground: (rows,) array of the expected ground disparity of each row, or
+    None if no ground plane could be fitted
+    """
+    rows = disparity_image.shape[0]
+    max_disparity = int(disparity_image.max()) + 1
+    # v-disparity: histogram of the disparities of each row (ignoring 0, unknown)
+    row_indices = np.repeat(np.arange(rows), disparity_image.shape[1])
+    v_disparity = np.bincount(row_indices * max_disparity + disparity_image.ravel(),
+                              minlength=rows * max_disparity).reshape(rows, max_disparity)
+    v_disparity[:, 0] = 0
+
+    # the ground dominates the lower half of the image
+    v = np.arange(rows // 2, rows)
+    mode_disparity = np.argmax(v_disparity[v], axis=1)
+    valid = v_disparity[v, mode_disparity] >= params.STIXEL_GROUND_MIN_COUNT
+    v, mode_disparity = v[valid], mode_disparity[valid]
+
+    # least squares line, refitted without the rows far from it (obstacles)
+    for _ in range(2):
+        if len(v) < params.STIXEL_GROUND_MIN_ROWS:
+            return None
+        slope, intercept = np.polyfit(v, mode_disparity, 1)
+        inliers = np.abs(slope * v + intercept - mode_disparity) <= params.STIXEL_GROUND_TOLERANCE
+        v, mode_disparity = v[inliers], mode_disparity[inliers]
+
+    # the disparity of the ground must grow towards the bottom of the image
+    if len(v) < params.STIXEL_GROUND_MIN_ROWS or slope <= 0:
+        return None
+    return slope * np.arange(rows) + intercept
+
+
+def generate_stixel_proposals(disparity_image, focal_length, distance_between_cameras,
+                              human_height, human_width, max_rects):
+    """
+    Proposes person-sized regions standing on the obstacles of a disparity image
+
+    Input(s):
+    -disparity_image: 8-bit disparity image (see detect_and_range.compute_disparity)
+    -focal_length: the focal length in pixels of the cameras used
+    -distance_between_cameras: the baseline distance in meters between the cameras
+    -human_height, human_width: size of a person (meters)
+    -max_rects: the maximum number of rectangles to return
+
+    Output(s):
+    -rects: (N, 4) array of region proposals (rects), where rect = x1, y1, w, h
+    """
+    rows, columns = disparity_image.shape
+    stripe_width = params.STIXEL_STRIPE_WIDTH
+    bin_width = params.STIXEL_DISPARITY_BIN_WIDTH
+
+    # obstacle pixels: known disparities standing out of the ground plane
+    obstacles = disparity_image > 0
+    ground = fit_ground_disparity(disparity_image)
+    if ground is not None:
+        obstacles &= disparity_image > (ground + params.STIXEL_GROUND_TOLERANCE)[:, np.newaxis]
+    obstacle_rows, obstacle_columns = np.nonzero(obstacles)
+    if len(obstacle_rows) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+
+    # histogram of the obstacle disparities of each stripe of columns, and the
+    # lowest row of each (stripe, disparity bin)
+    n_stripes = -(-columns // stripe_width)
+    n_bins = int(disparity_image.max()) // bin_width + 1
+    stixels = ((obstacle_columns // stripe_width) * n_bins +
+               disparity_image[obstacle_rows, obstacle_columns] // bin_width)
+    counts = np.bincount(stixels, minlength=n_stripes * n_bins)
+    bottoms = np.zeros(n_stripes * n_bins, dtype=np.intp)
+    np.maximum.at(bottoms, stixels, obstacle_rows)
+
+    # a person at the disparity of the bin would be this tall (pixels), as
+    # depth = focal_length * baseline / disparity
+    stixel_disparities = (np.arange(n_stripes * n_bins) % n_bins + 0.5) * bin_width
+    heights = human_height * stixel_disparities / distance_between_cameras
+    widths = human_width * stixel_disparities / distance_between_cameras
+
+    # keep the stixels filled enough to be an upright obstacle
+    expected_counts = params.STIXEL_MIN_FILL * np.minimum(heights, rows) * stripe_width
+    stixels = np.flatnonzero(np.logical_and(counts >= expected_counts, stixel_disparities >= 1))
+    if len(stixels) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+
+    # one person-sized box per stixel, centred on its stripe and standing on it
+    centres = (stixels // n_bins + 0.5) * stripe_width
+    boxes = np.column_stack((centres - widths[stixels] / 2, bottoms[stixels] - heights[stixels],
+                             centres + widths[stixels] / 2, bottoms[stixels] + 1))
+    boxes = np.round(boxes).astype(np.int32)
+    boxes[:, :2] = np.maximum(boxes[:, :2], 0)
+    boxes[:, 2] = np.minimum(boxes[:, 2], columns)
+    boxes[:, 3] = np.minimum(boxes[:, 3], rows)
+
+    # neighbouring stripes of the same obstacle give overlapping boxes
+    boxes = boxes[utils.non_max_suppression_fast(boxes, params.STIXEL_NMS_OVERLAP)]
+    return np.column_stack((boxes[:, :2], boxes[:, 2:] - boxes[:, :2]))[:max_rects]
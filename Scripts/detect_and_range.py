@@ -4,7 +4,8 @@
 
 General Usage is (into terminal from the Scripts/ directory):
 'python detect_and_range.py <model type> <start_image>'
-where <model_type> can be 'SVM' or 'MRCNN'
+where <model_type> can be 'SVM' or 'MRCNN' (or 'BENCHMARK' to compare the
+stereo matcher backends instead)
 and <start_image> can be "start" (indicating from the start) or the name
 of the image to start from
 
@@ -26,8 +27,14 @@ time_to_setup = cv2.getTickCount()
 print("setting up...")
 import os
 import sys
+import threading
+import queue
+import json
+import multiprocessing
+import concurrent.futures
 import numpy as np
 import utils
+import stage_cache
 #potential additional imports later found under "Model Settings" section
 # </section>End of Imports
 
@@ -40,6 +47,42 @@ cv2.setNumThreads(4)
 # </section>End of Disparity Settings
 
 
+# <section>~~~~~~~~~~~~~~~~~~~~~~~Pipeline Settings~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# how many stereo pairs the background reader may decode ahead of the
+# detection/ranging loop. 0 disables the reader thread (read in the loop)
+prefetch_queue_depth = 4
+
+# headless (batch) mode: no windows are opened and nothing is drawn. Instead,
+# the per-frame outputs are written to results_file_path (one JSON line per frame)
+headless = False
+results_file_path = "../Write/detections.jsonl"
+
+# number of worker processes the frames are sharded across (SVM only). Each
+# worker loads its own SVM, selective search and stereo processor objects.
+# 1 processes every frame in this process
+frame_worker_processes = 1
+# number of consecutive frames handed to a worker at a time
+frame_worker_chunk_size = 8
+# OpenCV threads per worker process (avoids oversubscribing the cores)
+frame_worker_opencv_threads = 1
+
+# number of frames Mask R-CNN detects at once (MRCNN only), in a single model
+# call with the model built for that batch size. Speeds up offline runs
+mrcnn_batch_size = 1
+
+# directory of the on-disk cache of the per-frame outputs of the disparity,
+# selective search and Mask R-CNN stages (see stage_cache.py), so that re-runs
+# with other settings only recompute the stages whose settings changed. None
+# disables the cache
+stage_cache_directory = None
+# size cap of the cache (bytes), the least recently used outputs are evicted
+stage_cache_max_bytes = 4 * 1024**3
+frame_cache = None
+if stage_cache_directory is not None:
+    frame_cache = stage_cache.StageCache(stage_cache_directory, stage_cache_max_bytes)
+# </section>End of Pipeline Settings
+
+
 # <section>~~~~~~~~~~~~~~~~~~~~~~~Directory Settings~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 master_path_to_dataset = "../Data/TTBB-durham-02-10-17-sub10"  # where is the data
 directory_to_cycle_left = "left-images"     # where are the left images
@@ -67,13 +110,16 @@ left_file_list = sorted(os.listdir(full_path_directory_left))
 specify classifier used as a string. Options include:
 - "SVM" for support vector machine
 - "MRCNN" for MaskRCNN
+- "BENCHMARK" to benchmark the stereo matcher backends (no detection)
 """
 model = sys.argv[1]
 # if the user asks for SVM
 if model == "SVM":
     # additional imports
-    from SVM.hog_detector import hog_detect # detector function
+    from SVM.hog_detector import hog_detect, propose_regions, SKY_ROWS # detector functions
     import SVM.params as params
+    import SVM.selective_search as selective_search
+    import SVM.proposal_tracking as proposal_tracking
     try:
         # load SVM object once, outside of loop
         svm = cv2.ml.SVM_load(params.HOG_SVM_PATH_SAVED)
@@ -92,7 +138,7 @@ elif model == "MRCNN":
 
     # additional imports
     import model as modellib # defines MaskRCNN model
-    from mask_rcnn_detector import mask_rcnn_detect # detector function
+    from mask_rcnn_detector import mask_rcnn_detect, mask_rcnn_detect_batch # detector functions
     import coco  # Import COCO config
     # </section> End of MRCNN imports
 
@@ -114,16 +160,49 @@ elif model == "MRCNN":
                                  'keyboard', 'cell phone', 'microwave', 'oven', 'toaster',
                                  'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors',
                                  'teddy bear', 'hair drier', 'toothbrush'])
+    # Names of the classes to detect, e.g. ["person", "bicycle", "car", "bus"]
+    # for road scenes, None for all classes. The other classes are dropped
+    # inside the detection layer, before per-class NMS
+    mrcnn_class_allow_list = None
+    # Input molding profiles: how frames are resized and padded before going
+    # through the network. "coco" pads frames to the 1024x1024 square of the
+    # COCO defaults, the others keep the aspect ratio of the (wide) cropped
+    # frames and only pad them to multiples of 64, with a decreasing maximum
+    # dimension, trading accuracy for speed
+    mrcnn_input_profile = "coco"
+    mrcnn_input_profiles = {
+        "coco": {"resize_mode": "square", "min_dim": 800, "max_dim": 1024},
+        "full": {"resize_mode": "fit64", "min_dim": 800, "max_dim": 1024},
+        "fast": {"resize_mode": "fit64", "min_dim": 800, "max_dim": 768},
+        "fastest": {"resize_mode": "fit64", "min_dim": 800, "max_dim": 512},
+    }
     # Local path to trained weights file
     COCO_MODEL_PATH = os.path.join(ROOT_DIR, "mask_rcnn_coco.h5")
 
+    # the allowed classes must be COCO classes, mapped to their IDs below
+    for name in mrcnn_class_allow_list or []:
+        if name not in deep_class_names:
+            raise ValueError("mrcnn_class_allow_list: unknown class {!r}, "
+                             "see deep_class_names for the COCO classes".format(name))
+
     # creating subsclass to quickly create custom config
     class InferenceConfig(coco.CocoConfig):
         # see coco.CocoConfig and config.py for more details
         # Set batch size to 1 since we'll be running inference on
         # one image at a time. Batch size = GPU_COUNT * IMAGES_PER_GPU
         GPU_COUNT = 1
-        IMAGES_PER_GPU = 1
+        IMAGES_PER_GPU = mrcnn_batch_size
+        # only the boxes are used, skip the mask branch and mask unmolding
+        DETECTION_ONLY = True
+        # mask_rcnn_detect only keeps the detections scoring 0.9 or more, drop
+        # the others before per-class NMS
+        DETECTION_MIN_CONFIDENCE = 0.9
+        # input molding of the selected profile
+        IMAGE_RESIZE_MODE = mrcnn_input_profiles[mrcnn_input_profile]["resize_mode"]
+        IMAGE_MIN_DIM = mrcnn_input_profiles[mrcnn_input_profile]["min_dim"]
+        IMAGE_MAX_DIM = mrcnn_input_profiles[mrcnn_input_profile]["max_dim"]
+        DETECTION_CLASS_ALLOW_LIST = None if mrcnn_class_allow_list is None else [
+            int(np.flatnonzero(deep_class_names == name)[0]) for name in mrcnn_class_allow_list]
 
     # create config object
     config = InferenceConfig()
@@ -140,14 +219,30 @@ elif model == "MRCNN":
 
     # Load weights trained on MS-COCO.
     mask_rcnn.load_weights(COCO_MODEL_PATH, by_name=True)
+
+    # All the frames of a sequence have the same size: compute the anchors for
+    # the molded shape of the (cropped) frames now, rather than on the first one
+    for filename in left_file_list:
+        if '.png' in filename:
+            frame = cv2.imread(os.path.join(full_path_directory_left, filename), cv2.IMREAD_COLOR)
+            if frame is not None:
+                mask_rcnn.prewarm_anchors(
+                    utils.crop_image(frame, 0, 390, 135, np.size(frame, 1)).shape)
+                break
     # </section>end of MRCNN Model Settings
 # </section> end of Model Settings
 
 
 # <section>~~~~~~~~~~~~~~~~~~~Selective Search Settings~~~~~~~~~~~~~~~~~~~~~~~~~~
 if model == "SVM":
-    # create Selective Search Segmentation Object using default parameters
-    ss = cv2.ximgproc.segmentation.createSelectiveSearchSegmentation()
+    # create Selective Search Segmentation Object for the selected profile
+    # (see SS_PROFILES in SVM/params.py)
+    ss = selective_search.create_selective_search(
+        params.SS_PROFILES[params.SS_PROFILE])
+    # reuse the proposals between consecutive frames (see SVM/params.py)
+    proposal_tracker = None
+    if params.HOG_DETECT_PROPOSAL_REUSE:
+        proposal_tracker = proposal_tracking.ProposalTracker()
 
 # </section>End of Disparity Settings
 
@@ -156,8 +251,91 @@ if model == "SVM":
 # setup the disparity stereo processor to find a maximum of 128 disparity values
 max_disparity = 128
 
+# exponent the grayscale images are raised to before matching
+disparity_gamma = 0.75
+# gamma correction of each 8-bit gray level, the same as
+# np.power(gray, disparity_gamma).astype('uint8') pixel by pixel
+gamma_lookup_table = np.power(np.arange(256, dtype=np.uint8), disparity_gamma).astype(np.uint8)
+# grayscale buffers of the left and right images, reused from frame to frame
+gray_buffers = []
+
+# disparity quality tier: the stereo pair is matched at full, half or quarter
+# resolution (with the disparity range scaled down alike), and the disparity is
+# upsampled back to full resolution. Lower tiers are faster but coarser
+disparity_quality = "full"
+# downsampling factor and block size of the stereo matching of each tier
+disparity_quality_tiers = {"full": (1, 21), "half": (2, 11), "quarter": (4, 5)}
+disparity_downsampling, sgbm_block_size = disparity_quality_tiers[disparity_quality]
+
+# stereo matcher backends, created from the number of disparities and the block
+# size. All of them compute disparities scaled by 16, as StereoSGBM does
+stereo_matcher_backends = {
+    "SGBM": lambda n, block: cv2.StereoSGBM_create(0, n, block),
+    "SGBM_3WAY": lambda n, block: cv2.StereoSGBM_create(
+        0, n, block, mode=cv2.STEREO_SGBM_MODE_SGBM_3WAY),
+    "HH": lambda n, block: cv2.StereoSGBM_create(0, n, block, mode=cv2.STEREO_SGBM_MODE_HH),
+    "HH4": lambda n, block: cv2.StereoSGBM_create(0, n, block, mode=cv2.STEREO_SGBM_MODE_HH4),
+    "BM": lambda n, block: cv2.StereoBM_create(n, block),
+    "sparse": lambda n, block: utils.SparseStereoMatcher(n, block),
+}
+# stereo matcher backend used (key of stereo_matcher_backends)
+stereo_matcher = "SGBM"
+matcher_num_disparities = max_disparity // disparity_downsampling
+
 # create stereo processor from OpenCv
-stereoProcessor = cv2.StereoSGBM_create(0, max_disparity, 21)
+stereoProcessor = stereo_matcher_backends[stereo_matcher](
+    matcher_num_disparities, sgbm_block_size)
+
+# number of horizontal stripes the stereo matching is split into, matched
+# concurrently by a thread pool with a stereo processor per stripe. 1 matches
+# the whole frame at once
+disparity_stripes = 1
+# rows each stripe is matched beyond its edges (at the matching resolution), so
+# that the stripes join without seams
+disparity_stripe_overlap = sgbm_block_size
+stripeProcessors = [stereo_matcher_backends[stereo_matcher](
+    matcher_num_disparities, sgbm_block_size) for _ in range(disparity_stripes)]
+stripe_executor = None
+if disparity_stripes > 1:
+    stripe_executor = concurrent.futures.ThreadPoolExecutor(disparity_stripes)
+
+# compute the disparity only over the rows kept by the crop (above the car
+# bonnet) and the rows the matching window needs below them, instead of over
+# the full frame. The columns left of the crop are still needed (the matching
+# costs are aggregated from the left edge). With the SGBM, SGBM_3WAY and BM
+# matchers the matched disparity of the kept rows is that of the full frame, at
+# every quality tier, and only speckles reaching into the bonnet can be
+# filtered differently. HH and HH4 also aggregate costs upwards from the last
+# row, so a few of their pixels can differ whatever the margin (as can the
+# features the sparse matcher picks over the matched rows)
+disparity_rows_only = False
+
+# recompute the disparity only over the horizontal bands of the frame that
+# changed since they were last matched, keeping their previous disparity
+# otherwise. Frames are expected in order (consecutive)
+disparity_incremental = False
+# rows per band (at the matching resolution). Bands are compared block by block
+# (square blocks of the same size)
+disparity_band_rows = 32
+# mean absolute gray level difference of a block above which its band changed
+disparity_change_threshold = 4.0
+# frames between forced full recomputations of the disparity
+disparity_refresh_interval = 10
+# gray images the disparity of each band was last matched on, last disparity
+# (16 times scaled, before speckle filtering) and frames since the last full
+# recomputation
+previous_matching = {}
+
+# MRCNN only: run detection first, then compute the disparity only over the
+# bands of rows covered by the detected boxes (no disparity at all without
+# detections). The disparity shown is then blank outside those bands
+mrcnn_lazy_disparity = False
+
+# stereo matcher benchmark (BENCHMARK model type): number of frames sampled
+# evenly from the sequence, and relative depth error within which a pixel's
+# depth agrees with that of the default backend (SGBM)
+benchmark_frames = 20
+benchmark_depth_tolerance = 0.1
 # </section>End of Disparity Settings
 
 
@@ -190,171 +368,754 @@ def join_paths_both_sides(directory_left, filename_left, directory_right, filena
     return full_path_filename_left, full_path_filename_right
 
 
-def convert_to_grayscale(color_images):
-    "Given an array of color images, returns an array of grayscale images"
+def select_frames(file_list, timestamp):
+    """
+    Applies the skip forward request to the (sorted) list of left image files,
+    returning only the filenames from the requested timestamp onwards
+    """
+    for index, filename in enumerate(file_list):
+        if not check_skip(timestamp, filename):
+            return file_list[index:]
+    return []
+
+
+def read_stereo_pair(filename_left):
+    """
+    Given the filename of a left image, resolves the corresponding right image
+    and reads both of them (as 3 channel images).
+
+    Returns filename_right, imgL, imgR. The images are None if the files are
+    not PNGs or if the right image does not exist
+    """
+    # from the left image filename get the correspondoning right image
+    filename_right = filename_left.replace("_L", "_R")
+    full_path_filename_left, full_path_filename_right = join_paths_both_sides(
+        full_path_directory_left, filename_left, full_path_directory_right, filename_right)
+
+    # check the file is a PNG file (left) and check a correspondoning right image
+    # actually exists
+    if ('.png' in filename_left) and (os.path.isfile(full_path_filename_right)):
+        # read left and right images (both have 3 channels)
+        imgL = cv2.imread(full_path_filename_left, cv2.IMREAD_COLOR)
+        imgR = cv2.imread(full_path_filename_right, cv2.IMREAD_COLOR)
+        if (imgL is not None) and (imgR is not None):
+            return filename_right, imgL, imgR
+    return filename_right, None, None
+
+
+def prefetch_stereo_pairs(file_list, queue_depth):
+    """
+    Reader stage of the frame loop. Walks file_list in order, reading each
+    stereo pair on a background thread and handing them over through a bounded
+    queue, so that image decoding overlaps with disparity and detection.
+
+    Input(s):
+    -file_list: list of left image filenames, in the order to process them
+    -queue_depth: max number of decoded pairs waiting to be processed. If 0,
+    pairs are read in the calling thread instead
+
+    Yields:
+    -filename_left, filename_right, imgL, imgR (see read_stereo_pair)
+    """
+    if queue_depth <= 0:
+        for filename_left in file_list:
+            with utils.stage_timer.time("image read"):
+                pair = (filename_left,) + read_stereo_pair(filename_left)
+            yield pair
+        return
+
+    pairs = queue.Queue(maxsize=queue_depth)
+    finished = object()  # sentinel marking the end of the file list
+    stop = threading.Event()  # set if the consumer stops early
+
+    def reader():
+        try:
+            for filename_left in file_list:
+                if stop.is_set():
+                    return
+                pairs.put((filename_left,) + read_stereo_pair(filename_left))
+            pairs.put(finished)
+        except Exception as error:  # hand the error over to the frame loop
+            pairs.put(error)
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    reader_thread.start()
+    try:
+        while True:
+            # only the time spent waiting on the reader counts towards the frame
+            with utils.stage_timer.time("image read"):
+                pair = pairs.get()
+            if pair is finished:
+                break
+            if isinstance(pair, Exception):
+                raise pair
+            yield pair
+    finally:
+        # unblock the reader if we are leaving before it is done
+        stop.set()
+        while reader_thread.is_alive():
+            try:
+                pairs.get_nowait()
+            except queue.Empty:
+                reader_thread.join(0.01)
+
+
+def write_frame_results(results_file, filename_left, filename_right, frame_detections, nearest):
+    """
+    Writes the outputs of a single frame as one JSON line to results_file
+
+    Input(s):
+    -results_file: open (text) file object
+    -filename_left, filename_right: filenames of the stereo pair
+    -frame_detections: list of dicts with the rect, class and depth of each detection
+    (all values finite, as the output must be valid JSON)
+    -nearest: the nearest-object line printed to the standard out
+    """
+    results_file.write(json.dumps({"left": filename_left,
+                                   "right": filename_right,
+                                   "detections": frame_detections,
+                                   "nearest": nearest}, allow_nan=False) + "\n")
+
+
+def preprocess_for_matching(color_images):
+    """
+    Given an array of color images, returns an array of gamma corrected
+    grayscale images. Each image is converted and corrected in place, within a
+    buffer reused from frame to frame (so the results are only valid until the
+    next call)
+    """
     gray_images = []
-    for image in color_images: # for each image,
-        gray_images.append(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)) # convert
+    for i, image in enumerate(color_images): # for each image,
+        # (re)allocate the buffer of this image if its size changed
+        if len(gray_buffers) <= i:
+            gray_buffers.append(None)
+        if gray_buffers[i] is None or gray_buffers[i].shape != image.shape[:2]:
+            gray_buffers[i] = np.empty(image.shape[:2], dtype=np.uint8)
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray_buffers[i]) # convert
+        cv2.LUT(gray_buffers[i], gamma_lookup_table, dst=gray_buffers[i]) # correct
+        gray_images.append(gray_buffers[i])
     return gray_images # return the gray images
 
 
-def compute_disparity(left_image, right_image, maximum_disparity, noise_filter, width):
+def compute_disparity_stripes(grayL, grayR):
+    """
+    Computes the (16 times scaled) disparity of a stereo pair as
+    disparity_stripes horizontal stripes, matched concurrently. Each stripe is
+    matched together with disparity_stripe_overlap rows on both sides, which
+    are then dropped
+    """
+    rows = grayL.shape[0]
+    stripe_edges = np.linspace(0, rows, disparity_stripes + 1).astype(int)
+
+    def match_stripe(stripe):
+        start, end = stripe_edges[stripe], stripe_edges[stripe + 1]
+        matched_start = max(0, start - disparity_stripe_overlap)
+        matched_end = min(rows, end + disparity_stripe_overlap)
+        disparity = stripeProcessors[stripe].compute(
+            grayL[matched_start:matched_end], grayR[matched_start:matched_end])
+        return disparity[start - matched_start:end - matched_start]
+
+    return np.vstack(list(stripe_executor.map(match_stripe, range(disparity_stripes))))
+
+
+def match_disparity(grayL, grayR):
+    """
+    Computes the (16 times scaled) disparity of a stereo pair, at once or as
+    concurrent stripes (see disparity_stripes)
+    """
+    if disparity_stripes > 1:
+        return compute_disparity_stripes(grayL, grayR)
+    return stereoProcessor.compute(grayL, grayR)
+
+
+def match_disparity_rows(grayL, grayR, disparity, start, end):
+    """
+    Computes the (16 times scaled) disparity of rows [start, end) of a stereo
+    pair into the given disparity image. The rows are matched together with
+    disparity_stripe_overlap rows on both sides, which are then dropped
+    """
+    rows = grayL.shape[0]
+    matched_start = max(0, start - disparity_stripe_overlap)
+    matched_end = min(rows, end + disparity_stripe_overlap)
+    disparity[start:end] = stereoProcessor.compute(
+        grayL[matched_start:matched_end],
+        grayR[matched_start:matched_end])[start - matched_start:end - matched_start]
+
+
+def compute_disparity_incremental(grayL, grayR):
+    """
+    Computes the (16 times scaled) disparity of a stereo pair, only matching
+    again the bands of rows whose blocks changed (see disparity_band_rows and
+    disparity_change_threshold) since they were last matched. Each changed run
+    of bands is matched with disparity_stripe_overlap rows on both sides.
+
+    The whole frame is matched every disparity_refresh_interval frames, and
+    whenever more than half of the bands changed (e.g. when the frames are not
+    consecutive)
+    """
+    rows, columns = grayL.shape
+    n_bands = -(-rows // disparity_band_rows)
+    full_refresh = (not previous_matching or
+                    previous_matching["grayL"].shape != grayL.shape or
+                    previous_matching["frames_since_refresh"] + 1 >= disparity_refresh_interval)
+
+    if not full_refresh:
+        # mean absolute difference of each block, in either image
+        block_grid = (-(-columns // disparity_band_rows), n_bands)
+        block_changes = np.maximum(
+            cv2.resize(cv2.absdiff(grayL, previous_matching["grayL"]), block_grid,
+                       interpolation=cv2.INTER_AREA),
+            cv2.resize(cv2.absdiff(grayR, previous_matching["grayR"]), block_grid,
+                       interpolation=cv2.INTER_AREA))
+        changed_bands = np.flatnonzero(block_changes.max(axis=1) > disparity_change_threshold)
+        full_refresh = len(changed_bands) > n_bands // 2
+
+    if full_refresh:
+        disparity = match_disparity(grayL, grayR)
+        previous_matching.update(grayL=grayL.copy(), grayR=grayR.copy(), frames_since_refresh=0)
+    else:
+        disparity = previous_matching["disparity"].copy()
+        # match each run of consecutive changed bands
+        for bands in np.split(changed_bands, np.flatnonzero(np.diff(changed_bands) > 1) + 1):
+            if len(bands) == 0:
+                continue
+            start = bands[0] * disparity_band_rows
+            end = min(rows, (bands[-1] + 1) * disparity_band_rows)
+            match_disparity_rows(grayL, grayR, disparity, start, end)
+            previous_matching["grayL"][start:end] = grayL[start:end]
+            previous_matching["grayR"][start:end] = grayR[start:end]
+        previous_matching["frames_since_refresh"] += 1
+
+    # kept apart from the returned disparity, which is filtered in place
+    previous_matching["disparity"] = disparity.copy()
+    return disparity
+
+
+def compute_disparity(left_image, right_image, maximum_disparity, noise_filter, width,
+                      row_bands=None):
     """
     Input:
     -Left & Rectified Right Images, Maximum Disparity Value
     -Noise filter: increase to be more aggressive
+    -Row bands: optional list of (start, end) rows to compute the disparity of,
+    leaving the others unknown (0). By default, all rows are computed
     Output:
     -Disparity between images, scaled appropriately
     """
-    # convert to grayscale (as the disparity matching works on grayscale)
-    grayL, grayR = convert_to_grayscale([left_image, right_image])
-
-    # perform preprocessing - raise to the power, as this subjectively appears
-    # to improve subsequent disparity calculation
-    grayL = np.power(grayL, 0.75).astype('uint8')
-    grayR = np.power(grayR, 0.75).astype('uint8')
+    if disparity_rows_only:
+        # rows below the crop only matter within half a matching window plus
+        # two rows, at the matching resolution. The crop is a whole number of
+        # downsampled rows (so that the downsampling grid stays that of the full
+        # frame), plus one downsampled row for the last partial one
+        computed_rows = (-(-390 // disparity_downsampling) + sgbm_block_size // 2 + 3) \
+            * disparity_downsampling
+        left_image, right_image = left_image[:computed_rows], right_image[:computed_rows]
+
+    # convert to grayscale (as the disparity matching works on grayscale) and
+    # perform preprocessing - raise to the power (disparity_gamma), as this
+    # subjectively appears to improve subsequent disparity calculation
+    with utils.stage_timer.time("preprocessing"):
+        grayL, grayR = preprocess_for_matching([left_image, right_image])
+
+    # downsample the pair to the resolution of the quality tier
+    if disparity_downsampling > 1:
+        with utils.stage_timer.time("downsampling"):
+            full_size = (grayL.shape[1], grayL.shape[0])
+            grayL, grayR = [cv2.resize(gray, None, fx=1.0 / disparity_downsampling,
+                                       fy=1.0 / disparity_downsampling,
+                                       interpolation=cv2.INTER_AREA) for gray in (grayL, grayR)]
 
     # compute disparity image from undistorted and rectified stereo images
     # (which for reasons best known to the OpenCV developers is returned scaled by 16)
-    disparity = stereoProcessor.compute(grayL, grayR)
+    with utils.stage_timer.time("SGBM"):
+        if row_bands is not None:
+            disparity = np.full(grayL.shape, -16, dtype=np.int16)
+            # bands at the matching resolution, merging the overlapping ones
+            bands = sorted((start // disparity_downsampling,
+                            min(grayL.shape[0], -(-end // disparity_downsampling)))
+                           for start, end in row_bands)
+            merged_bands = []
+            for start, end in bands:
+                if merged_bands and start <= merged_bands[-1][1]:
+                    merged_bands[-1][1] = max(merged_bands[-1][1], end)
+                elif start < end:
+                    merged_bands.append([start, end])
+            for start, end in merged_bands:
+                match_disparity_rows(grayL, grayR, disparity, start, end)
+        elif disparity_incremental:
+            disparity = compute_disparity_incremental(grayL, grayR)
+        else:
+            disparity = match_disparity(grayL, grayR)
+
+    # upsample the disparity back to full resolution, rescaling its values.
+    # Nearest neighbour keeps invalid (negative) pixels from bleeding into
+    # valid ones
+    if disparity_downsampling > 1:
+        with utils.stage_timer.time("upsampling"):
+            disparity = cv2.resize(disparity, full_size, interpolation=cv2.INTER_NEAREST)
+            disparity *= disparity_downsampling
 
     # filter out noise and speckles (adjust parameters as needed)
-    cv2.filterSpeckles(disparity, 0, 4000, maximum_disparity - noise_filter)
+    with utils.stage_timer.time("filterSpeckles"):
+        cv2.filterSpeckles(disparity, 0, 4000, maximum_disparity - noise_filter)
 
-    # threshold the disparity so that it goes from 0 to max disparity
-    _, disparity = cv2.threshold(
-        disparity, 0, maximum_disparity * 16, cv2.THRESH_TOZERO)
+    with utils.stage_timer.time("threshold"):
+        # threshold the disparity so that it goes from 0 to max disparity
+        _, disparity = cv2.threshold(
+            disparity, 0, maximum_disparity * 16, cv2.THRESH_TOZERO)
 
-    # scale the disparity to 8-bit for viewing
-    disparity_scaled = (disparity / 16.).astype(np.uint8)
+        # scale the disparity to 8-bit for viewing
+        disparity_scaled = (disparity / 16.).astype(np.uint8)
 
-    # crop area not seen by *both* cameras and and area with car bonnet
-    disparity_scaled = utils.crop_image(disparity_scaled, 0, 390, 135, width)
+        # crop area not seen by *both* cameras and and area with car bonnet
+        disparity_scaled = utils.crop_image(disparity_scaled, 0, 390, 135, width)
 
     return disparity_scaled
-# </section>End of Functions Section
-
 
-# <section>~~~~~~~~~~~~~~~~~~~~~~~~~~~~Main~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-Colors = utils.gen_N_colors(81) #get N different colors for the N possible classes
-
-utils.print_duration(time_to_setup) #print how long it took to set up
-
-# cycle through the images
-for filename_left in left_file_list:
-    # <section>---------------Directory Checks---------------
-    # skipping if requested
-    if check_skip(skip_forward_file_pattern, filename_left):
-        continue
-    else:
-        skip_forward_file_pattern = ""
 
-    # from the left image filename get the correspondoning right image
-    filename_right = filename_left.replace("_L", "_R")
-    full_path_filenames = join_paths_both_sides(full_path_directory_left, filename_left,
-                                                full_path_directory_right, filename_right)
-    full_path_filename_left, full_path_filename_right = full_path_filenames
-
-    # </section>-----------End of Directory Checks-----------
+def cached_stage(stage, file_paths, parameters, names, compute):
+    """
+    Returns the outputs of a stage (a tuple of arrays, named by names) for the
+    given image files from the stage cache. If they are not cached, computes
+    them with compute() and caches them. Without a cache (or file paths) the
+    outputs are always computed
+    """
+    if frame_cache is None or file_paths is None:
+        return compute()
+    key = frame_cache.key(stage, file_paths, parameters)
+    with utils.stage_timer.time("cache read"):
+        arrays = frame_cache.get(key, names)
+    if arrays is not None:
+        return tuple(arrays[name] for name in names)
+    outputs = compute()
+    with utils.stage_timer.time("cache write"):
+        frame_cache.put(key, dict(zip(names, outputs)))
+    return outputs
+
+
+def disparity_fingerprint():
+    """
+    Returns the settings compute_disparity depends on, for the stage cache
+    """
+    return {"max_disparity": max_disparity, "noise_filter": 5, "gamma": disparity_gamma,
+            "quality": disparity_quality_tiers[disparity_quality], "matcher": stereo_matcher,
+            "rows_only": disparity_rows_only,
+            "stripes": (disparity_stripes, disparity_stripe_overlap), "crop": (390, 135)}
 
-    # check the file is a PNG file (left) and check a correspondoning right image
-    # actually exists
-    if ('.png' in filename_left) and (os.path.isfile(full_path_filename_right)):
-        # read left and right images (both have 3 channels)
-        imgL = cv2.imread(full_path_filename_left, cv2.IMREAD_COLOR)
-        imgR = cv2.imread(full_path_filename_right, cv2.IMREAD_COLOR)
 
-        # compute image width
-        original_width = np.size(imgL, 1)
-
-        # compute disparity between images
-        disparity = compute_disparity(
-            imgL, imgR, max_disparity, 5, original_width)
-
-        # cropping left image to match disparity & depth sizes
-        imgL = utils.crop_image(imgL, 0, 390, 135, original_width)
-
-        # get detections as rectangles and their respective characteristics
-        # different course of action depending on model
-        if model == "SVM":
-            # detections, class numbers and depths computed by hog_detect
-            detection_rects, detection_classes, detection_depths = hog_detect(
-                imgL, svm, ss, disparity, camera_focal_length_px, stereo_camera_baseline_m)
-        elif model == "MRCNN":
-            # detections, class numbers, names, confidences computed by mask_rcnn_detect
-            detection_rects, detection_classes, detection_class_names, confidences = mask_rcnn_detect(
-                imgL, mask_rcnn, deep_class_names)
-            # get a single depth estimation for each detected object
+def detect_and_range_frame(imgL, imgR, file_paths=None, mrcnn_detect=None):
+    """
+    Computes the disparity, the detections and their depths for a single stereo
+    pair
+
+    Input(s):
+    -imgL, imgR: left and right (3 channel) images
+    -file_paths: optional paths of the left and right image files, identifying
+    the frame in the stage cache (see stage_cache_directory)
+    -mrcnn_detect: optional function returning the Mask R-CNN detections of
+    the (cropped) left image, e.g. out of a batch. mask_rcnn_detect by default
+
+    Output(s):
+    -imgL: left image, cropped to match the disparity
+    -disparity: disparity image (see compute_disparity)
+    -detections: list of dicts, one per detection, with keys "rect" (x1, y1,
+    x2, y2), "class_id", "class", "depth" and, for MRCNN, "confidence"
+    """
+    # compute image width
+    original_width = np.size(imgL, 1)
+
+    # MRCNN detections are only ranged once known, see mrcnn_lazy_disparity
+    lazy_disparity = model == "MRCNN" and mrcnn_lazy_disparity
+
+    # compute disparity between images. The incremental disparity depends on the
+    # previous frames, so it is not cached
+    if not lazy_disparity:
+        disparity, = cached_stage(
+            "disparity", None if disparity_incremental else file_paths,
+            disparity_fingerprint(), ["disparity"],
+            lambda: (compute_disparity(imgL, imgR, max_disparity, 5, original_width),))
+
+    # cropping left image to match disparity & depth sizes
+    imgL_uncropped = imgL
+    imgL = utils.crop_image(imgL, 0, 390, 135, original_width)
+
+    # get detections as rectangles and their respective characteristics
+    # different course of action depending on model
+    if model == "SVM":
+        # selective search proposals only depend on the left image (and the
+        # profile), so they are cached. Tracked or stixel proposals are not
+        region_proposals = None
+        if params.PROPOSAL_ENGINE == "selective_search" and proposal_tracker is None:
+            region_proposals, = cached_stage(
+                "proposals", file_paths and file_paths[:1],
+                {"profile": params.SS_PROFILES[params.SS_PROFILE], "sky_rows": SKY_ROWS,
+                 "crop": (390, 135)}, ["rects"],
+                lambda: (propose_regions(imgL, ss, disparity, camera_focal_length_px,
+                                         stereo_camera_baseline_m),))
+        # detections, class numbers and depths computed by hog_detect
+        detection_rects, detection_classes, detection_depths = hog_detect(
+            imgL, svm, ss, disparity, camera_focal_length_px, stereo_camera_baseline_m,
+            proposal_tracker, region_proposals)
+        # get class name based on class number
+        detection_class_names = [utils.get_class_name(int(det_class))
+                                 for det_class in detection_classes]
+        confidences = None
+    elif model == "MRCNN":
+        if mrcnn_detect is None:
+            mrcnn_detect = lambda: mask_rcnn_detect(imgL, mask_rcnn, deep_class_names)
+        # detections, class numbers, names, confidences computed by mask_rcnn_detect
+        # (cached along with the weights and the whole configuration, except for
+        # the batch size which does not change them). Only the detection itself
+        # is timed as "Mask R-CNN detect", the cache has timers of its own
+        def timed_mrcnn_detect():
+            with utils.stage_timer.time("Mask R-CNN detect"):
+                return mrcnn_detect()
+        detection_rects, detection_classes, detection_class_names, confidences = cached_stage(
+            "detections", file_paths and (file_paths[0], COCO_MODEL_PATH),
+            {name: getattr(config, name) for name in dir(config) if name.isupper() and
+             name not in ("BATCH_SIZE", "IMAGES_PER_GPU", "GPU_COUNT", "DETECTION_ONLY")},
+            ["rects", "class_ids", "classes", "scores"], timed_mrcnn_detect)
+        # compute the disparity of the rows of the detections only (the crop
+        # keeps the rows of the frame)
+        if lazy_disparity:
+            if len(detection_rects) > 0:
+                disparity = compute_disparity(
+                    imgL_uncropped, imgR, max_disparity, 5, original_width,
+                    [(int(y1), int(y2)) for x1, y1, x2, y2 in detection_rects])
+            else:
+                disparity = np.zeros(imgL.shape[:2], dtype=np.uint8)
+        # get a single depth estimation for each detected object
+        with utils.stage_timer.time("detection depth"):
             detection_depths = np.fromiter((utils.compute_single_depth(
                 rect, disparity, camera_focal_length_px, stereo_camera_baseline_m) for rect in detection_rects), float)
 
+    detections = []
+    for i in range(len(detection_classes)):
+        x1, y1, x2, y2 = detection_rects[i]
+        detection = {"rect": (int(x1), int(y1), int(x2), int(y2)),
+                     "class_id": int(detection_classes[i]),
+                     "class": str(detection_class_names[i]),
+                     "depth": float(detection_depths[i])}
+        if confidences is not None:
+            detection["confidence"] = float(confidences[i])
+        detections.append(detection)
 
-        # <section>-------------------Display-----------
-        min_depth = 100 # initialize to then store what the closest detection is
-        min_depth_class = "No Detections" # by default in case there are no detections
-        units = " meters"
-        # for each detection on the image
-        for i in range(len(detection_classes)):
-            # get rect
-            det_rect = detection_rects[i]
-            # extract vertex data
-            x1, y1, x2, y2 = det_rect
-
-            # different route depending on model
-            if model == "SVM":
-                # get class number
-                det_class = int(detection_classes[i])
-                # get class name based on class number
-                det_class_name = utils.get_class_name(det_class)
-                # get color based on class number
-                color = Colors[det_class]
-            elif model == "MRCNN":
-                # get class name
-                det_class_name = detection_class_names[i]
-                # get color based on class number
-                color = Colors[detection_classes[i]]
-                # get confidence
-                confidence = str(round(confidences[i], 2))
-
-            # get depth
-            det_depth = round(detection_depths[i], 1)
+    return imgL, disparity, detections
 
+
+def init_frame_worker():
+    """
+    Initializer of the frame worker processes: each worker gets its own SVM,
+    selective search (and proposal tracker) and stereo processor objects. The
+    jump between the chunks of frames a worker gets is caught by the scene
+    change check of the proposal tracker
+    """
+    global svm, ss, proposal_tracker, stereoProcessor, stripeProcessors, stripe_executor
+    cv2.setNumThreads(frame_worker_opencv_threads)
+    svm = cv2.ml.SVM_load(params.HOG_SVM_PATH_SAVED)
+    ss = selective_search.create_selective_search(
+        params.SS_PROFILES[params.SS_PROFILE])
+    if params.HOG_DETECT_PROPOSAL_REUSE:
+        proposal_tracker = proposal_tracking.ProposalTracker()
+    stereoProcessor = stereo_matcher_backends[stereo_matcher](
+        matcher_num_disparities, sgbm_block_size)
+    stripeProcessors = [stereo_matcher_backends[stereo_matcher](
+        matcher_num_disparities, sgbm_block_size) for _ in range(disparity_stripes)]
+    if disparity_stripes > 1:
+        stripe_executor = concurrent.futures.ThreadPoolExecutor(disparity_stripes)
+
+
+def process_frame_file(filename_left):
+    """
+    Reads and processes the stereo pair of the given left image filename. This
+    is the unit of work of the frame worker processes.
+
+    Returns filename_left, filename_right, imgL, disparity, detections (see
+    detect_and_range_frame) and the stage times of the frame, including the
+    time the worker spent on it as "frame". imgL, disparity and detections are
+    None if the pair could not be read. In headless mode the images are not
+    returned, since they are not displayed
+    """
+    frame_start = cv2.getTickCount()
+    with utils.stage_timer.time("image read"):
+        filename_right, imgL, imgR = read_stereo_pair(filename_left)
+    disparity, detections = None, None
+    if imgL is not None:
+        imgL, disparity, detections = detect_and_range_frame(
+            imgL, imgR, join_paths_both_sides(full_path_directory_left, filename_left,
+                                              full_path_directory_right, filename_right))
+    if headless:
+        imgL, disparity = None, None
+    utils.stage_timer.add("frame", utils.get_elapsed_time(frame_start))
+    return filename_left, filename_right, imgL, disparity, detections, utils.stage_timer.end_frame()
+
+
+def batched_mrcnn_frames(file_list):
+    """
+    Processes the stereo pairs of file_list as processed_frames does (MRCNN
+    only), detecting the frames in batches of mrcnn_batch_size. The frames of a
+    batch are detected with a single model call the first time the detections
+    of one of them are needed (so frames whose detections are cached do not
+    make the model run)
+    """
+    batch = []  # filenames and images of the frames of the current batch
+
+    def process_batch():
+        """yields the results of the frames of the batch, in order"""
+        cropped_images = [utils.crop_image(imgL, 0, 390, 135, np.size(imgL, 1))
+                          for _, _, imgL, _ in batch if imgL is not None]
+        batch_detections = []
+
+        def detect(index):
+            # run the whole batch through the model on the first request
+            if not batch_detections:
+                batch_detections.extend(mask_rcnn_detect_batch(
+                    cropped_images, mask_rcnn, deep_class_names))
+            return batch_detections[index]
+
+        index = 0
+        for filename_left, filename_right, imgL, imgR in batch:
+            if imgL is None:
+                yield filename_left, filename_right, None, None, None
+                continue
+            yield (filename_left, filename_right) + detect_and_range_frame(
+                imgL, imgR, join_paths_both_sides(full_path_directory_left, filename_left,
+                                                  full_path_directory_right, filename_right),
+                lambda index=index: detect(index))
+            index += 1
+
+    n_images = 0
+    for frame in prefetch_stereo_pairs(file_list, prefetch_queue_depth):
+        batch.append(frame)
+        n_images += frame[2] is not None
+        if n_images == mrcnn_batch_size:
+            yield from process_batch()
+            batch, n_images = [], 0
+    # final (partial) batch
+    if batch:
+        yield from process_batch()
+
+
+def processed_frames(file_list):
+    """
+    Processes the stereo pair of each left image filename in file_list,
+    yielding the results in the order of file_list (see process_frame_file)
+
+    With frame_worker_processes > 1 (SVM only), the frames are sharded across a
+    pool of worker processes, otherwise they are processed in this process with
+    the pairs read ahead by the background reader (see prefetch_stereo_pairs).
+    With mrcnn_batch_size > 1 (MRCNN only), the frames are detected in batches
+    (see batched_mrcnn_frames)
+    """
+    if model == "MRCNN" and mrcnn_batch_size > 1:
+        yield from batched_mrcnn_frames(file_list)
+        return
+
+    if model == "SVM" and frame_worker_processes > 1:
+        with multiprocessing.Pool(frame_worker_processes, init_frame_worker) as pool:
+            # imap returns the results in timestamp order
+            for frame in pool.imap(process_frame_file, file_list, frame_worker_chunk_size):
+                # collect the stage times measured by the worker
+                utils.stage_timer.add_frame_times(frame[-1])
+                yield frame[:-1]
+        return
+
+    # cycle through the images, which are read ahead by a background reader
+    for filename_left, filename_right, imgL, imgR in prefetch_stereo_pairs(
+            file_list, prefetch_queue_depth):
+        # check both images of the pair could be read
+        if imgL is None:
+            yield filename_left, filename_right, None, None, None
+        else:
+            yield (filename_left, filename_right) + detect_and_range_frame(
+                imgL, imgR, join_paths_both_sides(full_path_directory_left, filename_left,
+                                                  full_path_directory_right, filename_right))
+
+
+def output_frame(filename_left, filename_right, imgL, disparity, detections, results_file):
+    """
+    Prints the nearest detection of a frame and either displays the frame (with
+    its detections drawn on) or, in headless mode, writes its results to
+    results_file
+    """
+    min_depth = 100 # initialize to then store what the closest detection is
+    min_depth_class = "No Detections" # by default in case there are no detections
+    units = " meters"
+    # for each detection on the image
+    for detection in detections:
+        # get depth
+        det_depth = round(detection["depth"], 1)
+        det_class_name = detection["class"]
+
+        if not headless:
+            drawing_start = cv2.getTickCount()
+            # extract vertex data
+            x1, y1, x2, y2 = detection["rect"]
+            # get color based on class number
+            color = Colors[detection["class_id"]]
             # draw colored rectangle where detected object is
             cv2.rectangle(imgL, (x1, y1),
                           (x2, y2), color, 2)
             # label rectangle
             cv2.putText(imgL, "{}: {} m".format(det_class_name,
                                                 det_depth), (x1, y1 - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color)
-            if model == "MRCNN":
+            if "confidence" in detection:
                 # add confidence label
+                confidence = str(round(detection["confidence"], 2))
                 cv2.putText(imgL, "{}".format(confidence), (x1 + 4,
                                                             y1 + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color)
-            # determining if minimum depth
-            if det_depth < min_depth:
-                min_depth = det_depth
-                min_depth_class = det_class_name
-
-        # requested standard out
-        if min_depth >= 100:
-            min_depth = "Depth Irrelevant"
-            units = ""
-        print(filename_left)
-        print("{}: {} ({}{})\n".format(
-            filename_right, min_depth_class, min_depth, units))
-
-        # show left color image
-        cv2.imshow('detected objects', imgL)
-
-        # show disparity image (scaling it to the full 0->255 range)
-        cv2.imshow("disparity", (disparity *
-                                 (256 / max_disparity)).astype(np.uint8))
-
-        # wait 16ms (i.e. 1000ms / 60 fps = 16 ms) (i probably expect too much)
-        cv2.waitKey(16) & 0xFF
-        # </section>-------End of Display Section--------
+            utils.stage_timer.add("drawing", utils.get_elapsed_time(drawing_start))
+        # determining if minimum depth
+        if det_depth < min_depth:
+            min_depth = det_depth
+            min_depth_class = det_class_name
+
+    # requested standard out
+    if min_depth >= 100:
+        min_depth = "Depth Irrelevant"
+        units = ""
+    nearest = "{}: {} ({}{})".format(
+        filename_right, min_depth_class, min_depth, units)
+    print(filename_left)
+    print(nearest + "\n")
+
+    if headless:
+        results_start = cv2.getTickCount()
+        # write the frame outputs instead of displaying them
+        frame_detections = []
+        for detection in detections:
+            frame_detection = {"rect": list(detection["rect"]),
+                               "class": detection["class"],
+                               # no depth (e.g. no disparity in the box) is null,
+                               # as infinity and NaN are not valid JSON
+                               "depth": round(detection["depth"], 1)
+                               if np.isfinite(detection["depth"]) else None}
+            if "confidence" in detection:
+                frame_detection["confidence"] = detection["confidence"]
+            frame_detections.append(frame_detection)
+        write_frame_results(results_file, filename_left, filename_right,
+                            frame_detections, nearest)
+        utils.stage_timer.add("results write", utils.get_elapsed_time(results_start))
+    else:
+        with utils.stage_timer.time("display"):
+            # show left color image
+            cv2.imshow('detected objects', imgL)
+
+            # show disparity image (scaling it to the full 0->255 range)
+            cv2.imshow("disparity", (disparity *
+                                     (256 / max_disparity)).astype(np.uint8))
+
+            # wait 16ms (i.e. 1000ms / 60 fps = 16 ms) (i probably expect too much)
+            cv2.waitKey(16) & 0xFF
+
+
+def benchmark_stereo_matchers(file_list):
+    """
+    Compares the stereo matcher backends (see stereo_matcher_backends) on
+    benchmark_frames frames sampled evenly from file_list, printing for each
+    backend the disparity time per frame, the fraction of pixels with a known
+    disparity and how well its depths agree with those of the default (SGBM)
+    backend: the fraction of the pixels known to both that are within
+    benchmark_depth_tolerance, and the median relative depth error
+    """
+    global stereoProcessor, stripeProcessors
+
+    # read the sampled stereo pairs once, so that only matching is timed
+    sampled_indices = np.unique(np.linspace(
+        0, len(file_list) - 1, min(benchmark_frames, len(file_list))).astype(int))
+    stereo_pairs = []
+    for index in sampled_indices:
+        _, imgL, imgR = read_stereo_pair(file_list[index])
+        if imgL is not None:
+            stereo_pairs.append((imgL, imgR))
+    print("benchmarking on {} frames".format(len(stereo_pairs)))
+
+    print("{:<12} {:>10} {:>10} {:>10} {:>12}".format(
+        "backend", "ms/frame", "known", "agreeing", "median error"))
+    reference_disparities = None
+    for backend in sorted(stereo_matcher_backends, key=lambda backend: backend != "SGBM"):
+        stereoProcessor = stereo_matcher_backends[backend](
+            matcher_num_disparities, sgbm_block_size)
+        stripeProcessors = [stereo_matcher_backends[backend](
+            matcher_num_disparities, sgbm_block_size) for _ in range(disparity_stripes)]
+
+        disparities = []
+        start = cv2.getTickCount()
+        for imgL, imgR in stereo_pairs:
+            disparities.append(compute_disparity(
+                imgL, imgR, max_disparity, 5, np.size(imgL, 1)))
+        seconds = utils.get_elapsed_time(start)
+        if reference_disparities is None:
+            reference_disparities = disparities
+
+        n_pixels = n_known = 0
+        depth_errors = []
+        for disparity, reference_disparity in zip(disparities, reference_disparities):
+            n_pixels += disparity.size
+            n_known += np.count_nonzero(disparity)
+            known = np.logical_and(disparity > 0, reference_disparity > 0)
+            # as depth = focal_length * baseline / disparity
+            depth_errors.append(np.abs(
+                reference_disparity[known] / disparity[known].astype(np.float64) - 1))
+        depth_errors = np.concatenate(depth_errors) if depth_errors else np.empty(0)
+        if len(depth_errors) > 0:
+            agreeing = np.mean(depth_errors <= benchmark_depth_tolerance)
+            median_error = np.median(depth_errors)
+        else:
+            agreeing, median_error = np.nan, np.nan
+
+        print("{:<12} {:>10.2f} {:>9.1f}% {:>9.1f}% {:>11.1f}%".format(
+            backend, 1000 * seconds / max(len(stereo_pairs), 1),
+            100 * n_known / max(n_pixels, 1), 100 * agreeing, 100 * median_error))
+
+
+def main():
+    """
+    Runs detection and ranging over the stereo image sequence, from the
+    requested starting image onwards
+    """
+    # in headless mode, results are written to file instead of being displayed
+    results_file = open(results_file_path, "w") if headless else None
+
+    # keep only the images from the requested starting image onwards
+    frame_file_list = select_frames(left_file_list, skip_forward_file_pattern)
+
+    frame_start = cv2.getTickCount()
+    for filename_left, filename_right, imgL, disparity, detections in processed_frames(frame_file_list):
+        # frames from the worker processes come with the time the worker spent
+        # on them: only add the output to it, not the time waiting for them
+        if "frame" in utils.stage_timer.frame_times:
+            frame_start = cv2.getTickCount()
+        if detections is not None:
+            output_frame(filename_left, filename_right, imgL, disparity,
+                         detections, results_file)
+        else:
+            print("-- files skipped (perhaps one is missing or not PNG)\n")
+        # close the stage timings of this frame
+        utils.stage_timer.add("frame", utils.get_elapsed_time(frame_start))
+        utils.stage_timer.end_frame()
+        frame_start = cv2.getTickCount()
+
+    if headless:
+        results_file.close()
     else:
-        print("-- files skipped (perhaps one is missing or not PNG)\n")
+        # close all windows
+        cv2.destroyAllWindows()
+
+    # report how long each stage took
+    utils.stage_timer.report()
+# </section>End of Functions Section
 
-# close all windows
-cv2.destroyAllWindows()
+
+# <section>~~~~~~~~~~~~~~~~~~~~~~~~~~~~Main~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Colors = utils.gen_N_colors(81) #get N different colors for the N possible classes
+
+if __name__ == "__main__":
+    # setup time is reported along with the stages of the frame loop
+    utils.stage_timer.record("setup", utils.get_elapsed_time(time_to_setup))
+
+    if model == "BENCHMARK":
+        benchmark_stereo_matchers(select_frames(left_file_list, skip_forward_file_pattern))
+    else:
+        main()
 # </section>
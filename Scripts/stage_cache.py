@@ -0,0 +1,99 @@
+"""
+functionality: on-disk cache of the per-frame outputs of the expensive stages
+(disparity, region proposals, Mask R-CNN detections), so that re-runs over the
+same sequence with different settings only recompute what changed.
+
+Each output is a set of named arrays, saved as one .npy file per array and
+read back memory-mapped. Entries are keyed by the identity of the image files
+they were computed from (path, size, modification time) and a fingerprint of
+the settings they depend on. The least recently used files are evicted once
+the cache grows over its size cap.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+
+class StageCache(object):
+    """
+    Cache of stage outputs in a directory, holding at most max_bytes of arrays
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.n_bytes = None  # size of the cache, computed on the first write
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, stage, file_paths, parameters):
+        """
+        Returns the key of the output of a stage, computed from the given image
+        files with the given parameters (a JSON serializable dict)
+        """
+        identities = []
+        for file_path in file_paths:
+            status = os.stat(file_path)
+            identities.append((os.path.abspath(file_path), status.st_size, status.st_mtime_ns))
+        description = json.dumps([stage, identities, parameters], sort_keys=True, default=str)
+        return stage + "-" + hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def array_path(self, key, name):
+        """path of the file of an array of an entry"""
+        return os.path.join(self.directory, "{}.{}.npy".format(key, name))
+
+    def get(self, key, names):
+        """
+        Returns the (memory-mapped, read-only) arrays of an entry as a dict,
+        or None if the entry is not (fully) cached
+        """
+        arrays = {}
+        for name in names:
+            path = self.array_path(key, name)
+            try:
+                arrays[name] = np.load(path, mmap_mode="r")
+                # mark as recently used
+                os.utime(path)
+            except (OSError, ValueError):
+                return None
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        Saves the arrays (dict of name -> array) of an entry. Each file is
+        written under a temporary name and then renamed, so that other
+        processes never read a partially written file
+        """
+        for name, array in arrays.items():
+            path = self.array_path(key, name)
+            temporary_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(temporary_path, "wb") as array_file:
+                np.save(array_file, np.asarray(array))
+            os.replace(temporary_path, path)
+            if self.n_bytes is not None:
+                self.n_bytes += os.path.getsize(path)
+        if self.n_bytes is None or self.n_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used files until the cache fits in max_bytes
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    status = entry.stat()
+                except OSError:  # evicted by another process
+                    continue
+                files.append((status.st_mtime, status.st_size, entry.path))
+        files.sort()
+        self.n_bytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.n_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.n_bytes -= size
@@ -16,6 +16,7 @@ import SVM.params as params
 import math
 import random
 import colorsys
+import contextlib
 # </section>End of Imports
 
 
@@ -180,6 +181,22 @@ def compute_depth(disparity, focal_length, distance_between_cameras):
     return depth
 
 
+# disparity -> depth lookup tables, one for each camera setup
+depth_lookup_tables = {}
+
+
+def get_depth_lookup_table(focal_length, distance_between_cameras):
+    """
+    Returns a 256 entry table with the depth (meters) corresponding to each
+    8-bit disparity value. The table is only computed once per camera setup
+    """
+    key = (focal_length, distance_between_cameras)
+    if key not in depth_lookup_tables:
+        depth_lookup_tables[key] = compute_depth(
+            np.arange(256, dtype=np.uint8), focal_length, distance_between_cameras)
+    return depth_lookup_tables[key]
+
+
 def compute_single_depth(rectangle, disparity_image, focal_length, distance_between_cameras):
     """
     Given a rectangular area and a disparity image, estimates the general Depth
@@ -189,6 +206,10 @@ def compute_single_depth(rectangle, disparity_image, focal_length, distance_betw
     x1, y1, x2, y2 = rectangle
     # cropping and flattening disparity image so that we are only dealing with ROI values
     rectangle_disparity = crop_image(disparity_image, y1, y2, x1, x2)
+    # 8-bit disparities are counted rather than sorted (same estimate, in O(n))
+    if rectangle_disparity.dtype == np.uint8:
+        return compute_single_depth_counting(
+            rectangle_disparity, focal_length, distance_between_cameras)
     # sorting the disparity ROI by ascending disparity
     rectangle_disparity = np.sort(rectangle_disparity, axis=None)
     # keeping only the final third of the pixels (which we believe correspond to the detected object)
@@ -199,6 +220,31 @@ def compute_single_depth(rectangle, disparity_image, focal_length, distance_betw
         rectangle_disparity, focal_length, distance_between_cameras)
     # return the average depth
     return np.average(rectangle_depths)
+
+
+def compute_single_depth_counting(rectangle_disparity, focal_length, distance_between_cameras):
+    """
+    Counting version of compute_single_depth for 8-bit disparities: rather than
+    sorting the pixels, the number of pixels of each disparity value is counted
+    and the final (highest disparity) third of the pixels is selected from the
+    counts. Their depths come from the disparity -> depth lookup table.
+    """
+    # number of pixels of each disparity value
+    counts = np.bincount(rectangle_disparity.ravel(), minlength=256)
+    # the final third of the pixels (as if sorted by ascending disparity) is kept
+    n_pixels = rectangle_disparity.size
+    n_kept = n_pixels - (2 * n_pixels) // 3
+    if n_kept == 0:
+        return np.nan  # empty ROI, as np.average of no depths
+    # number of pixels with a higher disparity than each value
+    n_higher = n_pixels - np.cumsum(counts)
+    # number of pixels kept of each value, filling the final third from the top
+    n_kept_per_value = np.clip(n_kept - n_higher, 0, counts)
+    kept_values = np.flatnonzero(n_kept_per_value)
+    # average depth of the kept pixels
+    depth_lookup_table = get_depth_lookup_table(
+        focal_length, distance_between_cameras)
+    return np.dot(n_kept_per_value[kept_values], depth_lookup_table[kept_values]) / n_kept
 #   </section> End of Depth Functions
 
 #   <section>~~~~~~~~~~~~~~~~~Miscelleanous Functions~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -391,17 +437,17 @@ def area_depth_heuristic(height, width, pixel_height, pixel_width, distance, foc
     -mush_factor: how much leeway to give in comparing. Usually between 0 and 1
 
     Outputs:
-    -Boolean: True if satisfied, False if else.
+    -Boolean: True if satisfied, False if else. If the pixel sizes and distances
+    are arrays, an array of booleans (one per region)
     """
-    # expected area occupied by an object with passed size at passed distance
-    expected_area = (height * width * focal_length**2) / distance**2
+    with np.errstate(divide='ignore'): #ignore division by 0
+        # expected area occupied by an object with passed size at passed distance
+        expected_area = (height * width * focal_length**2) / np.square(distance)
     # observed area
-    observed_area = pixel_width * pixel_height
+    observed_area = np.multiply(pixel_width, pixel_height)
     # heuristic
-    if observed_area < (1 - mush_factor) * expected_area or observed_area > (1.2 + mush_factor) * expected_area:
-        return False
-    else:
-        return True
+    return np.logical_not(np.logical_or(observed_area < (1 - mush_factor) * expected_area,
+                                        observed_area > (1.2 + mush_factor) * expected_area))
 #   </section>End of Miscelleanous
 
 # </section>End of Functions
@@ -468,4 +514,199 @@ class ImageData(object): #TBreckon
         if show_additional_process_information:
             print("HOG descriptor computed - dimension: ",
                   self.hog_descriptor.shape)
+
+
+class StageTimer(object):
+    """
+    Times the individual stages of each frame. Stage times are accumulated
+    over the current frame, and the per-frame totals of each stage are kept so
+    that percentiles can be reported at the end of a run
+    """
+
+    def __init__(self):
+        self.frame_times = {}  # stage -> seconds spent in the current frame
+        self.stage_times = {}  # stage -> list of per-frame seconds
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """
+        context manager adding the time spent in its body to the given stage
+        """
+        start = cv2.getTickCount()
+        try:
+            yield
+        finally:
+            self.add(stage, get_elapsed_time(start))
+
+    def add(self, stage, seconds):
+        """adds seconds to the time of the given stage in the current frame"""
+        self.frame_times[stage] = self.frame_times.get(stage, 0.0) + seconds
+
+    def add_frame_times(self, frame_times):
+        """
+        adds the stage times of a frame timed elsewhere (e.g. in a worker process)
+        to the current frame
+        """
+        for stage, seconds in frame_times.items():
+            self.add(stage, seconds)
+
+    def end_frame(self):
+        """
+        records the stage times of the current frame and starts a new one.
+        Returns the stage times of the frame that just ended
+        """
+        frame_times = self.frame_times
+        for stage, seconds in frame_times.items():
+            self.record(stage, seconds)
+        self.frame_times = {}
+        return frame_times
+
+    def record(self, stage, seconds):
+        """records a single (complete) measurement of a stage"""
+        self.stage_times.setdefault(stage, []).append(seconds)
+
+    def report(self):
+        """prints p50/p95/p99 (in ms) and the total time spent in each stage"""
+        print("{:<20} {:>7} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "count", "p50 (ms)", "p95 (ms)", "p99 (ms)", "total (s)"))
+        for stage, times in self.stage_times.items():
+            p50, p95, p99 = 1000 * np.percentile(times, [50, 95, 99])
+            print("{:<20} {:>7} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                stage, len(times), p50, p95, p99, sum(times)))
+
+
+class IntegralDisparityHistogram(object):
+    """
+    Integral histogram of an 8-bit disparity image: one cumulative (integral
+    image) plane per disparity bin. Once built for a frame, the depth estimate
+    of compute_single_depth (average depth of the final third of the pixels by
+    disparity) can be answered for any rectangle in time proportional to the
+    number of bins rather than to the rectangle area.
+
+    Disparity 0 has its own bin, the remaining values are grouped in bins of
+    bin_width values. With bin_width = 1 the depths are the same as those of
+    compute_single_depth. Coarser bins are faster to build and smaller, but
+    the pixels kept from the partially kept bin are given that bin's average
+    depth within the rectangle
+    """
+
+    def __init__(self, disparity_image, focal_length, distance_between_cameras, bin_width=1):
+        self.bin_width = bin_width
+        self.height, self.width = disparity_image.shape[:2]
+        depth_lookup_table = get_depth_lookup_table(
+            focal_length, distance_between_cameras)
+
+        # bin of each disparity value: 0 on its own, then bin_width values per bin
+        value_bins = np.zeros(256, dtype=np.uint8)
+        value_bins[1:] = 1 + np.arange(255) // bin_width
+        binned_image = cv2.LUT(disparity_image, value_bins)
+        # bins above the largest disparity in the image would always be empty
+        n_bins = int(value_bins[disparity_image.max()]) + 1 if disparity_image.size else 1
+
+        # integral image of the pixel counts of each bin
+        self.counts = np.empty(
+            (n_bins, self.height + 1, self.width + 1), dtype=np.int32)
+        for b in range(n_bins):
+            self.counts[b] = cv2.integral((binned_image == b).view(np.uint8))
+
+        if bin_width == 1:
+            # every pixel in a bin has the same depth
+            self.bin_depths = depth_lookup_table[:n_bins]
+        else:
+            # integral image of the summed depths of each bin (bin 0 is always at
+            # infinity, so it has no sums)
+            depth_image = depth_lookup_table[disparity_image]
+            self.depth_sums = np.zeros(
+                (n_bins, self.height + 1, self.width + 1), dtype=np.float64)
+            for b in range(1, n_bins):
+                self.depth_sums[b] = cv2.integral(
+                    np.where(binned_image == b, depth_image, 0.0), sdepth=cv2.CV_64F)
+
+    def rectangle_sums(self, planes, rectangles):
+        """
+        Given integral image planes and an (N, 4) array of rects (x1, y1, x2, y2),
+        returns the (N, n_planes) sums of each plane within each rect
+        """
+        x1 = np.clip(rectangles[:, 0], 0, self.width)
+        y1 = np.clip(rectangles[:, 1], 0, self.height)
+        x2 = np.clip(rectangles[:, 2], x1, self.width)
+        y2 = np.clip(rectangles[:, 3], y1, self.height)
+        sums = planes[:, y2, x2] - planes[:, y1, x2] - \
+            planes[:, y2, x1] + planes[:, y1, x1]
+        return sums.T
+
+    def compute_depths(self, rectangles):
+        """
+        Estimates the depth of each rectangle, as compute_single_depth does.
+
+        Input: (N, 4) array-like of rects (x1, y1, x2, y2)
+        Output: (N,) array of depths in meters
+        """
+        rectangles = np.asarray(rectangles, dtype=np.intp).reshape(-1, 4)
+        counts = self.rectangle_sums(self.counts, rectangles)
+        # the final third of the pixels (as if sorted by ascending disparity) is kept
+        n_pixels = counts.sum(axis=1)
+        n_kept = n_pixels - (2 * n_pixels) // 3
+        # number of pixels in a higher bin than each bin
+        n_higher = n_pixels[:, np.newaxis] - np.cumsum(counts, axis=1)
+        # number of pixels kept of each bin, filling the final third from the top
+        n_kept_per_bin = np.clip(n_kept[:, np.newaxis] - n_higher, 0, counts)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.bin_width == 1:
+                bin_depths = self.bin_depths[np.newaxis, :]
+            else:
+                # average depth of each bin within each rect
+                bin_depths = self.rectangle_sums(
+                    self.depth_sums, rectangles) / counts
+                bin_depths[:, 0] = np.inf
+            # average depth of the kept pixels (empty rects give nan)
+            kept_depths = np.where(
+                n_kept_per_bin > 0, n_kept_per_bin * bin_depths, 0.0)
+            return kept_depths.sum(axis=1) / n_kept
+
+
+class SparseStereoMatcher(object):
+    """
+    Sparse stereo matcher, computing disparities with the interface of the
+    OpenCV stereo matchers (compute, disparities scaled by 16). Corners of the
+    left image are matched in the right image with pyramidal Lucas-Kanade
+    optical flow, and the disparity of each corner matched along its row fills
+    a block around it (the largest, i.e. nearest, disparity wins where blocks
+    overlap). Everywhere else the disparity is invalid (-16)
+    """
+
+    def __init__(self, num_disparities, block_size, max_corners=2000):
+        self.num_disparities = num_disparities
+        self.block_size = block_size
+        self.max_corners = max_corners
+
+    def compute(self, left, right):
+        """
+        Computes the disparity of a rectified 8-bit grayscale stereo pair
+        """
+        disparity = np.full(left.shape, -16, dtype=np.int16)
+        corners = cv2.goodFeaturesToTrack(left, self.max_corners, 0.01, self.block_size // 2)
+        if corners is None:
+            return disparity
+        matches, status, _ = cv2.calcOpticalFlowPyrLK(
+            left, right, corners, None, winSize=(self.block_size, self.block_size), maxLevel=3)
+        corners, matches = corners.reshape(-1, 2), matches.reshape(-1, 2)
+
+        # keep the matches along the same row, within the disparity range
+        corner_disparities = corners[:, 0] - matches[:, 0]
+        matched = np.logical_and.reduce((status.ravel() == 1,
+                                         np.abs(corners[:, 1] - matches[:, 1]) < 1,
+                                         corner_disparities >= 0,
+                                         corner_disparities < self.num_disparities))
+        x, y = np.round(corners[matched]).astype(np.intp).T
+        disparity[np.minimum(y, left.shape[0] - 1), np.minimum(x, left.shape[1] - 1)] = \
+            np.round(corner_disparities[matched] * 16)
+
+        # spread each matched disparity over a block
+        return cv2.dilate(disparity, np.ones((self.block_size, self.block_size), dtype=np.uint8))
+
+
+# timer shared by all stages of the detection and ranging loop
+stage_timer = StageTimer()
 # </section>End of Classes